@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+
+#  Benchmarks for the Elixir MCP server.
+#
+#  ./bench.py join [--files N] [--repeat R]
+#      Compare the ident join engines on a synthetic version with N files,
+#      for a rare identifier (3 files) and a very common one (half the files)
+#
+#  ./bench.py tools [--sizes N,N,...] [--tags T] [--repeat R] [--concurrency C] [--dir DIR]
+#      Run every MCP tool of main.py and every Query subcommand on synthetic
+#      projects of N files (see synth.py), kept in DIR between runs. Each
+#      size runs in its own process, reporting for every case the first
+#      (cold) call, the p50/p95 of R warm calls, the throughput of C
+#      concurrent calls and the peak RSS of the process so far.
+#
+#  ./bench.py startup [--repeat R]
+#      Start main.py over stdio R times and measure the time until the
+#      answers to the initialize handshake and to tools/list, and list the
+#      heavy modules imported at startup.
+#
+#  ./bench.py load [--clients N] [--calls C] [--files F] [--tags T] [--dir DIR]
+#      Start main.py with the sse transport on a synthetic project and run
+#      N concurrent MCP client sessions, each making C random tool calls.
+#      Reports the throughput, latency percentiles, errors, peak RSS of the
+#      server and the hit ratios of its shared caches.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+import data
+import join
+import lib
+import manifest
+
+def make_version(files, seed=0):
+    '''Returns the raw PathList of a synthetic version: sorted blob ids,
+        about 1% of the blobs present under two paths.'''
+    rng = random.Random(seed)
+    pathlist = data.PathList()
+    blob_id = 0
+    for i in range(files):
+        blob_id += rng.randint(1, 5)
+        pathlist.append(blob_id, f'dir{i % 97}/sub{i % 13}/file{i}.c'.encode())
+        if rng.random() < 0.01:
+            pathlist.append(blob_id, f'copy/file{i}.c'.encode())
+    return pathlist.pack()
+
+def make_reflist(version, count, seed=1):
+    '''Returns a RefList referencing `count` blobs of the version, plus some
+        blobs of other versions which must not match.'''
+    rng = random.Random(seed)
+    ids = sorted({int(line.split(b' ')[0]) for line in version.split(b'\n')[:-1]})
+    chosen = sorted(rng.sample(ids, min(count, len(ids))))
+    missing = [i * 5 + 2 for i in range(count // 10)]
+    reflist = data.RefList()
+    for blob_id in sorted(set(chosen) | set(missing)):
+        reflist.append(blob_id, str(rng.randint(1, 5000)), rng.choice('CCCK'))
+    return reflist
+
+def refs_scan(version, reflist, family):
+    '''The PathList walk used by Query.get_idents_defs before manifests.'''
+    rBuf = []
+    refs = reflist.iter(dummy=True)
+    ref_idx, ref_lines, ref_family = next(refs)
+    for file_idx, file_path in data.PathList(version).iter():
+        while ref_idx < file_idx:
+            ref_idx, ref_lines, ref_family = next(refs)
+        if ref_idx == file_idx:
+            if lib.compatibleFamily(family, ref_family) or family == 'A':
+                rBuf.append((file_path, ref_lines))
+    return sorted(rBuf)
+
+def refs_join(m, reflist, family, engine):
+    '''The manifest join used by Query.get_idents_defs.'''
+    rBuf = []
+    compatible = {}
+    for ref_family in {e[2] for e in reflist.entries()}:
+        compatible[ref_family] = family == 'A' or lib.compatibleFamily(family, ref_family.decode())
+    refs = [e for e in reflist.entries() if compatible[e[2]]]
+    sel, pos = join.match(m, [e[0] for e in refs], engine=engine)
+    for i, p in zip(sel, pos):
+        rBuf.append((m.path(p), refs[i][1].decode()))
+    return sorted(rBuf)
+
+def timeit(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, res
+
+def cmd_join(files, repeat, **kwargs):
+    version = make_version(files)
+    m = manifest.Manifest(manifest.build(version))
+    print(f'version: {len(m)} files')
+
+    engines = ['bisect']
+    if join.numpy is not None:
+        engines.append('numpy')
+    else:
+        print('numpy is not installed, skipping the numpy engine')
+
+    print(f'{"ident":<8} {"refs":>7} {"engine":<8} {"best (ms)":>10} {"speedup":>8}')
+    for name, count in (('rare', 3), ('common', files // 2)):
+        reflist = make_reflist(version, count)
+        base, expected = timeit(lambda: refs_scan(version, reflist, 'C'), repeat)
+        print(f'{name:<8} {count:>7} {"scan":<8} {base*1000:>10.3f} {1:>8.1f}')
+        for engine in engines:
+            best, res = timeit(lambda: refs_join(m, reflist, 'C', engine), repeat)
+            # A blob present under several paths is reported for every path
+            # by both implementations, results must be identical
+            assert res == expected, f'{engine} engine returned different results'
+            print(f'{name:<8} {count:>7} {engine:<8} {best*1000:>10.3f} {base/best:>8.1f}')
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def tool_cases(q, tags):
+    '''Returns the (name, coroutine function) benchmark cases, for all the
+        tools of main.py and the Query subcommands.'''
+    import main
+    import synth
+
+    first, latest = synth.tag_name(0), synth.tag_name(tags - 1)
+    path = synth.file_path(0)
+    rare, hot = 'sym1', synth.HOT_IDENTS[0]
+    idents = [f'sym{i}' for i in range(20)]
+
+    def query(*args):
+        return lambda: asyncio.to_thread(q.query, *args)
+
+    return [
+        ('query_ident rare', lambda: main.query_ident(latest, rare)),
+        ('query_ident hot', lambda: main.query_ident(latest, hot)),
+        ('query_ident hot all', lambda: main.query_ident(latest, hot, limit=0)),
+        ('query_idents 20', lambda: main.query_idents(latest, idents)),
+        ('query_ident_history', lambda: main.query_ident_history(rare, first, latest)),
+        ('get_tags', lambda: main.get_tags()),
+        ('get_versions', lambda: main.get_versions()),
+        ('get_commit_info', lambda: main.get_commit_info(latest)),
+        ('get_commit_info first', lambda: main.get_commit_info(first, limit=1000)),
+        ('list_dir', lambda: main.list_dir(latest, '/include')),
+        ('list_dir detail', lambda: main.list_dir(latest, '/dir0', detail=True)),
+        ('list_dir recursive', lambda: main.list_dir(latest, '/', recursive=True, max_depth=2)),
+        ('get_file_meta_info', lambda: main.get_file_meta_info(latest, path)),
+        ('get_file_content', lambda: main.get_file_content(latest, path)),
+        ('check_if_file_exist', lambda: main.check_if_file_exist(latest, path)),
+        ('check_if_directory_exist', lambda: main.check_if_directory_exist(latest, '/dir0/sub0')),
+        ('check_if_commit_exist', lambda: main.check_if_commit_exist(latest)),
+        ('check_if_version_exist', lambda: main.check_if_version_exist(latest)),
+        ('list_projects', lambda: main.list_projects()),
+        ('get_server_metrics', lambda: main.get_server_metrics()),
+        # Only reads the settings, profiling stays as configured by the environment
+        ('set_profiling', lambda: main.set_profiling()),
+        ('Query versions', query('versions')),
+        ('Query latest', query('latest')),
+        ('Query type', query('type', latest, '/' + path)),
+        ('Query exist', query('exist', latest, '/' + path)),
+        ('Query dir', query('dir', latest, '/dir0')),
+        ('Query file', query('file', latest, '/' + path)),
+        ('Query family', query('family', path)),
+        ('Query dts-comp', query('dts-comp')),
+        ('Query dts-comp-exists', query('dts-comp-exists', 'vendor,dev')),
+        ('Query keys', query('keys', 'vers')),
+        ('Query ident rare', query('ident', latest, rare, 'C')),
+        ('Query ident hot', query('ident', latest, hot, 'C')),
+    ]
+
+async def run_case(fn, repeat, concurrency):
+    '''Returns the cold latency, warm latencies and throughput of a case.'''
+    start = time.perf_counter()
+    res = await fn()
+    cold = time.perf_counter() - start
+    # Tools report errors in a json response instead of raising, some
+    # successful responses are plain text
+    if isinstance(res, str) and res.startswith('{') and json.loads(res)['status'] != 'success':
+        raise RuntimeError(res)
+
+    warm = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        warm.append(time.perf_counter() - start)
+
+    calls = max(repeat, concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    async def limited():
+        async with semaphore:
+            await fn()
+    start = time.perf_counter()
+    await asyncio.gather(*(limited() for _ in range(calls)))
+    throughput = calls / (time.perf_counter() - start)
+    return cold, warm, throughput
+
+def cmd_tools_run(tags, repeat, concurrency, cases, **kwargs):
+    # Environment prepared by cmd_tools: main reads it when imported
+    import main
+    q = main.get_query('linux')
+
+    async def run():
+        for name, fn in tool_cases(q, tags):
+            if cases and not any(c in name for c in cases.split(',')):
+                continue
+            cold, warm, throughput = await run_case(fn, repeat, concurrency)
+            print(json.dumps({
+                'case': name,
+                'cold': cold,
+                'p50': percentile(warm, 0.5),
+                'p95': percentile(warm, 0.95),
+                'throughput': throughput,
+                # Kilobytes on Linux
+                'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            }), flush=True)
+
+    asyncio.run(run())
+
+def cmd_tools(sizes, tags, repeat, concurrency, dir, cases, **kwargs):
+    import synth
+
+    print(f'{"files":>7} {"case":<26} {"cold (ms)":>10} {"p50 (ms)":>10} {"p95 (ms)":>10} {"ops/s":>9} {"RSS (MB)":>9}')
+    for size in (int(s) for s in sizes.split(',')):
+        base_dir = os.path.join(dir, f'{size}-{tags}')
+        if not os.path.exists(base_dir):
+            synth.generate(base_dir, files=size, tags=tags, log=lambda msg: print(f'{size:>7} {msg}'))
+
+        env = dict(os.environ,
+                   LXR_BASE_DIR=base_dir,
+                   REPO_DIR=os.path.join(base_dir, synth.PROJECT, 'repo'),
+                   LXR_CACHE_DIR=os.path.join(base_dir, 'cache'))
+        cmd = [sys.executable, os.path.abspath(__file__), 'tools-run', '--tags', str(tags),
+               '--repeat', str(repeat), '--concurrency', str(concurrency), '--cases', cases]
+        proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, text=True)
+        for line in proc.stdout:
+            r = json.loads(line)
+            print(f'{size:>7} {r["case"]:<26} {r["cold"]*1000:>10.3f} {r["p50"]*1000:>10.3f} '
+                  f'{r["p95"]*1000:>10.3f} {r["throughput"]:>9.0f} {r["maxrss"]:>9.1f}')
+        if proc.wait() != 0:
+            sys.exit(f'benchmark failed for {size} files')
+
+# Modules which must only be imported on first use
+HEAVY_MODULES = ['berkeleydb', 'numpy', 'git', 'data', 'query']
+
+def rpc_call(proc, id, method, params):
+    proc.stdin.write(json.dumps({'jsonrpc': '2.0', 'id': id, 'method': method, 'params': params}) + '\n')
+    proc.stdin.flush()
+    for line in proc.stdout:
+        message = json.loads(line)
+        if message.get('id') == id:
+            return message
+    raise RuntimeError(f'main.py exited before answering {method}')
+
+def cmd_startup(repeat, **kwargs):
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    initialize, tools = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, main_py], stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        rpc_call(proc, 1, 'initialize', {
+            'protocolVersion': '2024-11-05',
+            'capabilities': {},
+            'clientInfo': {'name': 'bench', 'version': '0'},
+        })
+        initialize.append(time.perf_counter() - start)
+        proc.stdin.write(json.dumps({'jsonrpc': '2.0', 'method': 'notifications/initialized'}) + '\n')
+        res = rpc_call(proc, 2, 'tools/list', {})
+        tools.append(time.perf_counter() - start)
+        # The stdio transport does not always exit when stdin is closed
+        proc.terminate()
+        proc.wait()
+
+    print(f'{"answer":<12} {"min (ms)":>10} {"p50 (ms)":>10} {"max (ms)":>10}')
+    for name, times in (('initialize', initialize), ('tools/list', tools)):
+        print(f'{name:<12} {min(times)*1000:>10.1f} {percentile(times, 0.5)*1000:>10.1f} {max(times)*1000:>10.1f}')
+    print(f'{len(res["result"]["tools"])} tools')
+
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(main_py), os.environ.get('PYTHONPATH')])))
+    res = subprocess.run([sys.executable, '-c', f'import sys, main; print(*(m for m in {HEAVY_MODULES!r} if m in sys.modules))'],
+                         env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    if res.returncode != 0:
+        sys.exit('cannot import main')
+    print(f'heavy modules imported at startup: {res.stdout.strip() or "none"}')
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_port(port, proc, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            sys.exit('main.py exited during startup')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    sys.exit('main.py did not start listening')
+
+def peak_rss(pid):
+    # Peak resident set size in MB, Linux only
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def load_calls(tags, files, seed):
+    '''Returns a list of (tool, arguments) picked at random, hot identifiers
+        and files are chosen more often so that sessions share cache entries.'''
+    import synth
+    rng = random.Random(seed)
+    versions = [synth.tag_name(t) for t in range(tags)]
+    def version():
+        return versions[-1] if rng.random() < 0.7 else rng.choice(versions)
+    def ident():
+        return rng.choice(synth.HOT_IDENTS) if rng.random() < 0.2 else f'sym{int(rng.paretovariate(1.2)) % files}'
+    def path():
+        return '/' + synth.file_path(int(rng.paretovariate(1.2)) % files)
+    while True:
+        yield rng.choice([
+            lambda: ('query_ident', {'version': version(), 'ident': ident(), 'limit': 50}),
+            lambda: ('query_idents', {'version': version(), 'idents': [ident() for _ in range(5)]}),
+            lambda: ('get_file_content', {'version': version(), 'path': path()}),
+            lambda: ('check_if_file_exist', {'version': version(), 'path': path()}),
+            lambda: ('list_dir', {'version': version(), 'path': os.path.dirname(path())}),
+            lambda: ('get_commit_info', {'commit_id': version(), 'limit': 20}),
+            lambda: ('get_versions', {}),
+        ])()
+
+async def load_client(url, calls, tags, files, seed, latencies, errors):
+    from mcp import ClientSession
+    from mcp.client.sse import sse_client
+
+    async with sse_client(url) as streams:
+        async with ClientSession(*streams) as session:
+            await session.initialize()
+            for _, (tool, arguments) in zip(range(calls), load_calls(tags, files, seed)):
+                start = time.perf_counter()
+                res = await session.call_tool(tool, arguments)
+                latencies.append(time.perf_counter() - start)
+                text = res.content[0].text if res.content else ''
+                if res.isError or (text.startswith('{') and json.loads(text)['status'] != 'success'):
+                    errors.append((tool, arguments, text[:200]))
+
+async def load_metrics(url):
+    from mcp import ClientSession
+    from mcp.client.sse import sse_client
+
+    async with sse_client(url) as streams:
+        async with ClientSession(*streams) as session:
+            await session.initialize()
+            res = await session.call_tool('get_server_metrics', {})
+            return json.loads(res.content[0].text)['result']
+
+def cmd_load(clients, calls, files, tags, dir, **kwargs):
+    import synth
+
+    base_dir = os.path.join(dir, f'{files}-{tags}')
+    if not os.path.exists(base_dir):
+        synth.generate(base_dir, files=files, tags=tags)
+
+    port = free_port()
+    env = dict(os.environ,
+               LXR_BASE_DIR=base_dir,
+               LXR_CACHE_DIR=os.path.join(base_dir, 'cache'),
+               LXR_TRANSPORT='sse',
+               LXR_HOST='127.0.0.1',
+               LXR_PORT=str(port))
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    proc = subprocess.Popen([sys.executable, main_py], env=env, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_port(port, proc)
+        url = f'http://127.0.0.1:{port}/sse'
+        latencies, errors = [], []
+
+        async def run():
+            await asyncio.gather(*(load_client(url, calls, tags, files, seed, latencies, errors)
+                                   for seed in range(clients)))
+
+        start = time.perf_counter()
+        asyncio.run(run())
+        elapsed = time.perf_counter() - start
+        server_metrics = asyncio.run(load_metrics(url))
+        rss = peak_rss(proc.pid)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+    print(f'{clients} clients, {len(latencies)} calls in {elapsed:.2f}s: {len(latencies) / elapsed:.0f} calls/s')
+    print(f'latency (ms): p50 {percentile(latencies, 0.5)*1000:.2f}, p95 {percentile(latencies, 0.95)*1000:.2f}, '
+          f'p99 {percentile(latencies, 0.99)*1000:.2f}, max {max(latencies)*1000:.2f}')
+    print(f'errors: {len(errors)}')
+    for error in errors[:5]:
+        print(f'  {error}')
+    if rss is not None:
+        print(f'server peak RSS: {rss:.1f} MB')
+    for name, stats in server_metrics['caches'].items():
+        if stats['hit_ratio'] is not None:
+            print(f'cache {name:<14} {stats["entries"]:>7} entries, hit ratio {stats["hit_ratio"]:.2f}')
+    if errors:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(required=True)
+
+    join_subparser = subparsers.add_parser('join', help="Compare the ident join engines")
+    join_subparser.add_argument('--files', type=int, default=70000, help="Number of files in the version")
+    join_subparser.add_argument('--repeat', type=int, default=5, help="Number of runs, the best one is reported")
+    join_subparser.set_defaults(func=cmd_join)
+
+    def add_tools_arguments(subparser):
+        subparser.add_argument('--tags', type=int, default=20, help="Number of tags of the synthetic projects")
+        subparser.add_argument('--repeat', type=int, default=20, help="Number of warm calls of each case")
+        subparser.add_argument('--concurrency', type=int, default=8, help="Number of concurrent calls for the throughput")
+        subparser.add_argument('--cases', default='', help="Comma separated substrings of the cases to run, default: all")
+
+    tools_subparser = subparsers.add_parser('tools', help="Benchmark the MCP tools and Query subcommands")
+    tools_subparser.add_argument('--sizes', default='1000,10000,50000', help="Comma separated numbers of files")
+    tools_subparser.add_argument('--dir', default='bench-data', help="Directory of the synthetic projects, kept between runs")
+    add_tools_arguments(tools_subparser)
+    tools_subparser.set_defaults(func=cmd_tools)
+
+    startup_subparser = subparsers.add_parser('startup', help="Measure the startup time of the stdio server")
+    startup_subparser.add_argument('--repeat', type=int, default=10, help="Number of server starts")
+    startup_subparser.set_defaults(func=cmd_startup)
+
+    load_subparser = subparsers.add_parser('load', help="Load test of the sse transport with concurrent clients")
+    load_subparser.add_argument('--clients', type=int, default=16, help="Number of concurrent client sessions")
+    load_subparser.add_argument('--calls', type=int, default=50, help="Number of tool calls of each client")
+    load_subparser.add_argument('--files', type=int, default=10000, help="Number of files of the synthetic project")
+    load_subparser.add_argument('--tags', type=int, default=20, help="Number of tags of the synthetic project")
+    load_subparser.add_argument('--dir', default='bench-data', help="Directory of the synthetic projects, kept between runs")
+    load_subparser.set_defaults(func=cmd_load)
+
+    # Internal: one size, in the environment set up by `tools`
+    tools_run_subparser = subparsers.add_parser('tools-run')
+    add_tools_arguments(tools_run_subparser)
+    tools_run_subparser.set_defaults(func=cmd_tools_run)
+
+    args = parser.parse_args()
+    args.func(**vars(args))
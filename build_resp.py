@@ -1,11 +1,46 @@
-import json 
+import json
+import os
+import time
 from datetime import datetime
 
+import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 响应的json格式: pretty为缩进4格的格式, compact为紧凑格式, auto时小响应使用pretty,大响应使用compact
+JSON_MODE = os.environ.get("LXR_JSON_MODE", "auto")
+
+# auto模式下紧凑格式超过这个字节数的响应不再缩进
+COMPACT_THRESHOLD = int(os.environ.get("LXR_JSON_COMPACT_BYTES", "32768"))
+
+def encode_default(obj):
+    # SymbolInstance等结果对象直接序列化,不需要调用者先转换为字典
+    try:
+        return obj.to_dict()
+    except AttributeError:
+        pass
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
 class DateTimeEncoder(json.JSONEncoder):
     def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return super().default(obj)
+        return encode_default(obj)
+
+def dumps_compact(obj) -> str:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=encode_default, option=orjson.OPT_PASSTHROUGH_DATACLASS).decode()
+        except TypeError:
+            # orjson不支持的内容(例如无法编码为utf-8的路径)交给json模块处理
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), cls=DateTimeEncoder)
+
+def dumps_pretty(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, indent=4, cls=DateTimeEncoder)
 
 def build_raw_resp(data=None, message="", status="unKnown") -> str:
     resp = {
@@ -13,7 +48,15 @@ def build_raw_resp(data=None, message="", status="unKnown") -> str:
         "message": message,
         "status": status
     }
-    return json.dumps(resp, ensure_ascii=False, indent=4, cls=DateTimeEncoder)
+    start = time.perf_counter()
+    if JSON_MODE == "pretty":
+        text = dumps_pretty(resp)
+    else:
+        text = dumps_compact(resp)
+        if JSON_MODE == "auto" and len(text) < COMPACT_THRESHOLD:
+            text = dumps_pretty(resp)
+    metrics.observe("json.encode", time.perf_counter() - start)
+    return text
 
 def build_success_resp(data=None, message="请求成功") -> str:
     return build_raw_resp(data=data, message=message, status="success")
@@ -21,6 +21,7 @@
 import berkeleydb
 import re
 import lib
+import metrics
 from lib import *
 import os
 import os.path
@@ -28,6 +29,7 @@ import errno
 
 deflist_regex = re.compile(b'(\d*)(\w)(\d*)(\w),?')
 deflist_macro_regex = re.compile('\dM\d+(\w)')
+reflist_regex = re.compile(rb'(\d*):([^:\n]*):([^\n]*)\n')
 
 ##################################################################################
 
@@ -73,6 +75,11 @@ class DefList:
         if dummy:
             yield maxId, None, None, None
 
+    def entries(self):
+        '''Returns the raw (id, type, line, family) byte strings, unsorted and
+            undecoded, so that callers can decode only the entries they need.'''
+        return deflist_regex.findall(self.data)
+
     def append(self, id, type, line, family):
         if type not in defTypeD:
             return
@@ -138,6 +145,10 @@ class RefList:
         if dummy:
             yield maxId, None, None
 
+    def entries(self):
+        '''Returns the raw (id, lines, family) byte strings, unsorted and undecoded.'''
+        return reflist_regex.findall(self.data)
+
     def append(self, id, lines, family):
         p = str(id) + ':' + lines + ':' + family + '\n'
         self.data += p.encode()
@@ -158,13 +169,18 @@ class BsdDB:
             flags |= berkeleydb.db.DB_CREATE
             self.db.open(filename, flags=flags, mode=0o644, dbtype=berkeleydb.db.DB_BTREE)
         self.ctype = contentType
+        name = os.path.splitext(os.path.basename(filename))[0]
+        self.get_counter = 'bdb.get.' + name
+        self.exists_counter = 'bdb.exists.' + name
 
     def exists(self, key):
         key = lib.autoBytes(key)
+        metrics.count(self.exists_counter)
         return self.db.exists(key)
 
     def get(self, key):
         key = lib.autoBytes(key)
+        metrics.count(self.get_counter)
         p = self.db.get(key)
         return self.ctype(p) if p is not None else None
 
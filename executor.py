@@ -0,0 +1,86 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import profiling
+
+# 每一类资源的并发上限,可以通过环境变量调整
+#   git : 读取git对象,执行git命令
+#   cpu : 标识符查询(Berkeley DB查询和结果合并)等CPU密集型计算
+LIMITS = {
+    "git": int(os.getenv("LXR_GIT_CONCURRENCY", "8")),
+    "cpu": int(os.getenv("LXR_CPU_CONCURRENCY", str(os.cpu_count() or 2))),
+}
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+# 正在执行或排队的阻塞调用数量,只在事件循环线程中修改
+_running = 0
+
+
+def get_executor(kind: str) -> ThreadPoolExecutor:
+    """返回某一类资源专用的线程池,线程池在第一次使用时创建"""
+    with _executors_lock:
+        executor = _executors.get(kind)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max(1, LIMITS[kind]),
+                                          thread_name_prefix=f"lxr-{kind}")
+            _executors[kind] = executor
+        return executor
+
+
+async def run_blocking(kind: str, fn, /, *args, **kwargs):
+    """在kind对应的线程池中执行阻塞函数fn,不阻塞asyncio事件循环
+
+    当前的contextvars会被复制到工作线程中
+    """
+    global _running
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, fn, *args, **kwargs)
+    _running += 1
+    try:
+        return await loop.run_in_executor(get_executor(kind), call)
+    finally:
+        _running -= 1
+
+
+def running() -> int:
+    """返回正在执行或排队的阻塞调用数量,后台任务可以据此避让请求"""
+    return _running
+
+
+def blocking(kind: str):
+    """将同步函数包装成在kind对应线程池中执行的异步函数
+
+    包装后的函数保留原函数的签名和文档,可以直接用@mcp.tool()注册.
+    启用了metrics时记录每个函数的耗时(包括排队等待的时间)和返回的字节数,
+    启用了profiling时按设置对部分调用进行性能分析
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            call = (fn,)
+            if profiling.enabled():
+                call = (profiling.call, fn.__name__, fn)
+            if not metrics.enabled:
+                return await run_blocking(kind, *call, *args, **kwargs)
+            start = time.perf_counter()
+            result = await run_blocking(kind, *call, *args, **kwargs)
+            metrics.observe_tool(fn.__name__, time.perf_counter() - start, result)
+            return result
+        return wrapper
+    return decorator
+
+
+def shutdown(wait=True):
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=wait)
+        _executors.clear()
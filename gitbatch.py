@@ -0,0 +1,271 @@
+#  Persistent `git cat-file --batch` workers used instead of forking
+#  script.sh + git for every blob, type and tree lookup.
+
+import atexit
+import logging
+import os
+import queue
+import subprocess
+import threading
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Number of long-lived git processes per repository and per mode
+DEFAULT_POOL_SIZE = int(os.environ.get('LXR_GIT_WORKERS', '4'))
+
+# Maximum number of object names written to git before reading the answers
+PIPELINE_CHUNK = 256
+
+class CatFileError(Exception):
+    pass
+
+# Build a "<rev>:<path>" object name the same way script.sh does:
+# paths are given with a leading '/', which denormalize() strips
+def object_ref(version, path):
+    return version + ':' + path[1:]
+
+class CatFileProcess:
+    '''One `git cat-file --batch` (or --batch-check) process.
+        Not thread safe: CatFilePool hands each process to a single caller at a time.'''
+    def __init__(self, repo_dir, mode):
+        self.repo_dir = repo_dir
+        self.mode = mode
+        self.proc = None
+        self.start()
+
+    def start(self):
+        args = ['git', '-C', self.repo_dir, 'cat-file', self.mode]
+        metrics.count_subprocess(args)
+        self.proc = subprocess.Popen(
+            args,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.stdout = self.proc.stdout
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def restart(self):
+        self.close()
+        self.start()
+
+    def close(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+        self.proc.stdout.close()
+        self.proc = None
+
+    def _read_exact(self, size):
+        data = self.stdout.read(size)
+        if len(data) != size:
+            raise CatFileError('git cat-file exited unexpectedly')
+        return data
+
+    def _read_line(self):
+        line = self.stdout.readline()
+        if not line.endswith(b'\n'):
+            raise CatFileError('git cat-file exited unexpectedly')
+        return line[:-1]
+
+    # Returns (sha, type, size, content) or None if the object does not exist.
+    # content is None for --batch-check processes.
+    def request(self, ref):
+        return self.request_many([ref])[0]
+
+    # Pipeline several requests: write a chunk of object names, then read all
+    # answers. Chunks keep both pipes below their capacity so that git never
+    # blocks on a full stdout while we are still writing to its stdin.
+    def request_many(self, refs):
+        # Object names cannot contain a newline, they simply do not exist
+        valid = [ref for ref in refs if b'\n' not in ref]
+        answers = []
+        for i in range(0, len(valid), PIPELINE_CHUNK):
+            chunk = valid[i:i+PIPELINE_CHUNK]
+            self.proc.stdin.write(b''.join(ref + b'\n' for ref in chunk))
+            self.proc.stdin.flush()
+            answers.extend(self._read_answer() for _ in chunk)
+        if len(valid) == len(refs):
+            return answers
+        answers.reverse()
+        return [answers.pop() if b'\n' not in ref else None for ref in refs]
+
+    def _read_answer(self):
+        line = self._read_line()
+        # "<ref> missing" or "<ref> ambiguous", the ref may contain spaces
+        if line.endswith(b' missing') or line.endswith(b' ambiguous'):
+            return None
+        header = line.split(b' ')
+        if len(header) != 3:
+            raise CatFileError('unexpected git cat-file answer: %r' % line)
+        sha, type, size = header[0], header[1].decode(), int(header[2])
+        content = None
+        if self.mode == '--batch':
+            content = self._read_exact(size + 1)[:-1]
+        return sha.decode(), type, size, content
+
+class CatFilePool:
+    '''Pool of persistent cat-file processes for one repository.
+        Requests are multiplexed over at most `size` processes per mode,
+        dead processes are restarted and the request is retried once.'''
+    def __init__(self, repo_dir, size=DEFAULT_POOL_SIZE):
+        self.repo_dir = repo_dir
+        self.size = max(1, size)
+        self.lock = threading.Lock()
+        self.idle = {'--batch': queue.LifoQueue(), '--batch-check': queue.LifoQueue()}
+        self.slots = {mode: threading.Semaphore(self.size) for mode in self.idle}
+        self.procs = []
+        self.closed = False
+
+    def _acquire(self, mode):
+        self.slots[mode].acquire()
+        try:
+            try:
+                proc = self.idle[mode].get_nowait()
+            except queue.Empty:
+                proc = CatFileProcess(self.repo_dir, mode)
+                with self.lock:
+                    self.procs.append(proc)
+            if not proc.alive():
+                proc.restart()
+        except BaseException:
+            # The slot must not be lost if git cannot be started
+            self.slots[mode].release()
+            raise
+        return proc
+
+    def _release(self, mode, proc):
+        self.idle[mode].put(proc)
+        self.slots[mode].release()
+
+    def _request(self, mode, ref):
+        return self._request_many(mode, [ref])[0]
+
+    def _request_many(self, mode, refs):
+        if self.closed:
+            raise CatFileError('cat-file pool is closed')
+        refs = [ref.encode() if type(ref) is str else ref for ref in refs]
+        metrics.count('cat_file.' + mode.lstrip('-'), len(refs))
+        proc = self._acquire(mode)
+        try:
+            try:
+                return proc.request_many(refs)
+            except (CatFileError, OSError):
+                logger.warning('git cat-file %s crashed, restarting', mode)
+                proc.restart()
+                return proc.request_many(refs)
+        except Exception:
+            # Leave the process in a clean state for the next caller
+            proc.restart()
+            raise
+        finally:
+            self._release(mode, proc)
+
+    # Returns (sha, type, size) or None
+    def info(self, ref):
+        res = self._request('--batch-check', ref)
+        return res[:3] if res is not None else None
+
+    # Returns a list of (sha, type, size) or None, in the order of refs
+    def info_many(self, refs):
+        return [res[:3] if res is not None else None
+                for res in self._request_many('--batch-check', refs)]
+
+    # Returns (sha, type, content) or None
+    def read(self, ref):
+        res = self._request('--batch', ref)
+        return (res[0], res[1], res[3]) if res is not None else None
+
+    def get_type(self, ref):
+        res = self.info(ref)
+        return res[1] if res is not None else ''
+
+    def get_blob(self, ref):
+        res = self.read(ref)
+        if res is None or res[1] != 'blob':
+            return None
+        return res[2]
+
+    # Returns the list of (mode, type, sha, name) entries of a tree, or None
+    def get_tree(self, ref):
+        res = self.read(ref)
+        if res is None or res[1] not in ('tree', 'commit'):
+            return None
+        if res[1] == 'commit':
+            res = self.read(ref + '^{tree}' if type(ref) is str else ref + b'^{tree}')
+        sha, _, content = res
+        return parse_tree(content, len(sha) // 2)
+
+    # Formats (mode, type, sha, name) tree entries as `script.sh get-dir`
+    # does: "type name size mode" lines, dot files excluded, trees first
+    # then sorted by name
+    def format_dir(self, entries):
+        entries = [e for e in entries if not e[3].startswith('.')]
+        sizes = self.info_many([e[2] for e in entries if e[1] == 'blob'])
+        sizes.reverse()
+        lines = []
+        for mode, type, sha, name in entries:
+            size = '-'
+            if type == 'blob':
+                res = sizes.pop()
+                size = str(res[2]) if res is not None else '-'
+            lines.append((type, name, size, mode))
+        lines.sort(key=lambda l: l[1])
+        lines.sort(key=lambda l: l[0], reverse=True)
+        return [' '.join(l) for l in lines]
+
+    def close(self):
+        self.closed = True
+        with self.lock:
+            procs, self.procs = self.procs, []
+        for proc in procs:
+            proc.close()
+
+def parse_tree(content, sha_len=20):
+    entries = []
+    pos = 0
+    end = len(content)
+    while pos < end:
+        sp = content.index(b' ', pos)
+        nul = content.index(b'\0', sp)
+        mode = content[pos:sp].decode().rjust(6, '0')
+        name = content[sp+1:nul].decode('utf-8', errors='surrogateescape')
+        sha = content[nul+1:nul+1+sha_len].hex()
+        pos = nul + 1 + sha_len
+        if mode == '040000':
+            type = 'tree'
+        elif mode == '160000':
+            type = 'commit'
+        else:
+            type = 'blob'
+        entries.append((mode, type, sha, name))
+    return entries
+
+# Process-wide pools, one per repository
+pools = {}
+pools_lock = threading.Lock()
+
+def get_pool(repo_dir, size=DEFAULT_POOL_SIZE):
+    repo_dir = os.path.abspath(repo_dir)
+    with pools_lock:
+        pool = pools.get(repo_dir)
+        if pool is None or pool.closed:
+            pool = CatFilePool(repo_dir, size)
+            pools[repo_dir] = pool
+        return pool
+
+@atexit.register
+def close_pools():
+    with pools_lock:
+        for pool in pools.values():
+            pool.close()
+        pools.clear()
@@ -0,0 +1,431 @@
+import os
+import stat
+import subprocess
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+import cache
+import gitbatch
+import metrics
+import pathindex
+import refs
+import tags
+
+# git tree中各类条目的mode
+MODE_TREE = 0o040000
+MODE_SYMLINK = 0o120000
+MODE_SUBMODULE = 0o160000
+
+# 解析后的git tree缓存,键是tree的sha. git对象的内容由sha唯一确定,缓存永远不需要失效
+tree_cache = cache.LRUCache("tree", int(os.environ.get("LXR_TREE_CACHE_MB", "64")) * 1024 * 1024,
+                            sizeof=lambda entries: 200 + sum(100 + len(e[3]) for e in entries))
+
+# commit的元数据,修改的文件列表和每个文件的patch的缓存,键包含commit的完整sha.
+# commit的内容由sha唯一确定,缓存永远不需要失效
+commit_cache = cache.LRUCache("commit", int(os.environ.get("LXR_COMMIT_CACHE_MB", "64")) * 1024 * 1024)
+
+# 超过这个数量的文件时,不再通过命令行参数指定要生成patch的文件
+MAX_PATHSPECS = 1000
+
+# commit中被修改的一个文件, change_type与GitPython一致(A, D, M, R, C, T),
+# old_path只有重命名和复制时才有, insertions和deletions对二进制文件为None
+Change = namedtuple("Change", ["path", "old_path", "change_type", "insertions", "deletions"])
+
+# git tree中的一个条目, type为blob, tree或commit(子模块), size只有blob才有
+TreeEntry = namedtuple("TreeEntry", ["name", "path", "mode", "type", "sha", "size"])
+
+
+def normalize_path(path: str) -> str:
+    """将相对于源码根目录的路径(例如 /drivers/gpu/)转换为git tree中的路径(例如 drivers/gpu)"""
+    return "/".join(p for p in path.split("/") if p and p != ".")
+
+
+def human_size(size: int) -> str:
+    """模仿tree -h的格式输出文件大小,例如 123, 4.0K, 12M"""
+    value = float(size)
+    for unit in ("", "K", "M", "G", "T"):
+        if value < 1024 or unit == "T":
+            if unit == "":
+                return f"{int(value):>4}"
+            if value < 10:
+                return f"{value:>3.1f}{unit}"
+            return f"{value:>3.0f}{unit}"
+        value /= 1024
+    return str(size)
+
+
+def entry_type(entry: TreeEntry) -> str:
+    """返回git条目对应的类型: directory, file 或 submodule"""
+    if entry.type == "tree":
+        return "directory"
+    if entry.type == "commit":
+        return "submodule"
+    return "file"
+
+
+class GitStore:
+    """直接从git对象库(blob和tree)中读取指定版本的文件和目录
+
+    所有的读取都不会检出(checkout)仓库,也不会修改工作区。对象的读取通过常驻的
+    `git cat-file`进程池完成,可以在多个线程中并发执行
+    """
+
+    def __init__(self, repo_dir: str):
+        self.repo_dir = repo_dir
+        self.git = gitbatch.get_pool(repo_dir)
+        self.refs = refs.get_resolver(repo_dir)
+
+    def get_tags(self) -> tags.Tags:
+        """返回仓库中所有tag的目录,tag有变化时会自动重新读取"""
+        return tags.get_catalog(self.repo_dir).get()
+
+    def resolve_commit(self, rev: str):
+        """将版本号,tag或commit id解析为commit的hash,不存在时返回None"""
+        res = self.refs.resolve(rev)
+        return res.commit if res is not None else None
+
+    def commit_exists(self, rev: str) -> bool:
+        return self.resolve_commit(rev) is not None
+
+    def run_git(self, *args, **kwargs):
+        args = ["git", "--literal-pathspecs", "-C", self.repo_dir, *args]
+        metrics.count_subprocess(args)
+        return subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, **kwargs)
+
+    def commit_info(self, rev: str) -> dict:
+        """返回commit的元数据和相对于第一个父commit修改的文件列表(Change),不存在时抛出异常"""
+        sha = self.resolve_commit(rev)
+        if sha is None:
+            raise RuntimeError(f"commit {rev}不存在")
+        info = commit_cache.get(("info", sha))
+        if info is not None:
+            return info
+
+        headers, _, message = self.git.read(sha)[2].partition(b"\n\n")
+        parents = []
+        author = b""
+        for line in headers.split(b"\n"):
+            key, _, value = line.partition(b" ")
+            if key == b"parent":
+                parents.append(value.decode())
+            elif key == b"author":
+                author = value
+
+        # author的格式为: 名字 <邮箱> 时间戳 时区
+        name, _, rest = author.partition(b" <")
+        email, _, rest = rest.partition(b"> ")
+        timestamp, _, tz = rest.decode().partition(" ")
+        offset = timedelta(hours=int(tz[1:3] or 0), minutes=int(tz[3:5] or 0))
+        date = datetime.fromtimestamp(int(timestamp or 0), timezone(-offset if tz.startswith("-") else offset))
+
+        # 和GitPython一样检测重命名,合并commit只和第一个父commit比较
+        base = [parents[0], sha] if parents else ["--root", sha]
+        res = self.run_git("diff-tree", "-r", "-M", "-z", "--raw", "--numstat", "--no-commit-id", *base)
+        if res.returncode != 0:
+            raise RuntimeError(f"读取commit {rev}修改的文件失败")
+        tokens = res.stdout.split(b"\0")
+        raw = []
+        i = 0
+        while i < len(tokens) and tokens[i].startswith(b":"):
+            status = tokens[i].split(b" ")[4].decode()
+            if status[0] in "RC":
+                raw.append((status[0], tokens[i + 1], tokens[i + 2]))
+                i += 3
+            else:
+                raw.append((status[0], None, tokens[i + 1]))
+                i += 2
+        changes = []
+        for change_type, old_path, path in raw:
+            insertions, deletions, rest = tokens[i].split(b"\t", 2)
+            i += 3 if not rest else 1
+            changes.append(Change(
+                path.decode("utf-8", "surrogateescape"),
+                old_path.decode("utf-8", "surrogateescape") if old_path is not None else None,
+                change_type,
+                int(insertions) if insertions != b"-" else None,
+                int(deletions) if deletions != b"-" else None,
+            ))
+
+        info = {
+            "sha": sha,
+            "author": name.decode("utf-8", "replace"),
+            "author_email": email.decode("utf-8", "replace"),
+            "date": date,
+            "message": message.decode("utf-8", "replace").strip(),
+            "parents": parents,
+            "base": base,
+            "changes": changes,
+        }
+        size = 1000 + len(message) + sum(200 + 2 * len(c.path) for c in changes)
+        commit_cache.put(("info", sha), info, size)
+        return info
+
+    def read_patches(self, info: dict, changes: list, max_file_bytes: int):
+        """按顺序产生changes中每个文件的(patch文本, 是否被截断), 每个文件的patch最多保留max_file_bytes字节
+
+        patch从`git diff-tree -p`的输出中流式读取,调用者停止迭代时git进程会被终止
+        """
+        args = ["diff-tree", "-r", "-M", "-p", "--no-commit-id", *info["base"]]
+        wanted = None
+        if len(changes) <= MAX_PATHSPECS:
+            args.append("--")
+            for c in changes:
+                args.append(c.path)
+                if c.old_path is not None:
+                    args.append(c.old_path)
+        else:
+            # 输出的顺序和commit_info中的文件列表一致,跳过不需要的文件
+            wanted = set(changes)
+
+        args = ["git", "--literal-pathspecs", "-C", self.repo_dir, *args]
+        metrics.count_subprocess(args)
+        proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            sections = iter(info["changes"] if wanted is not None else changes)
+            current = None
+            header = None
+            content = []
+            size = 0
+            in_header = True
+
+            def section():
+                patch = b"".join(content)
+                return patch[:max_file_bytes].decode("utf-8", "replace"), size > max_file_bytes
+
+            for line in proc.stdout:
+                if line.startswith(b"diff --git "):
+                    # 类型变化(T,例如普通文件变为符号链接)输出为同一路径的删除和新建两段,合并为一个文件的patch
+                    if line == header:
+                        in_header = True
+                        continue
+                    header = line
+                    if current is not None and (wanted is None or current in wanted):
+                        yield section()
+                    current = next(sections, None)
+                    content = []
+                    size = 0
+                    in_header = True
+                    continue
+                # 和GitPython一样,patch文本从第一个hunk开始,不包含文件头
+                if in_header:
+                    if not (line.startswith(b"@@") or line.startswith(b"Binary files")):
+                        continue
+                    in_header = False
+                if size < max_file_bytes:
+                    content.append(line)
+                size += len(line)
+            if current is not None and (wanted is None or current in wanted):
+                yield section()
+        finally:
+            proc.kill()
+            proc.stdout.close()
+            proc.wait()
+
+    def commit_patches(self, info: dict, changes: list, max_file_bytes: int, max_total_bytes: int) -> list:
+        """返回changes中每个文件的(patch文本, 是否被截断)
+
+        每个文件最多max_file_bytes字节,所有文件合计最多max_total_bytes字节,
+        超出总预算后的文件为(None, True)
+        """
+        results = [commit_cache.get(("patch", info["sha"], c, max_file_bytes)) for c in changes]
+        fetched = self.read_patches(info, [c for c, r in zip(changes, results) if r is None], max_file_bytes)
+        patches = []
+        total = 0
+        try:
+            for c, res in zip(changes, results):
+                if total >= max_total_bytes:
+                    patches.append((None, True))
+                    continue
+                if res is None:
+                    res = next(fetched, ("", False))
+                    commit_cache.put(("patch", info["sha"], c, max_file_bytes), res, 200 + len(res[0]))
+                patch, truncated = res
+                if total + len(patch) > max_total_bytes:
+                    patch, truncated = patch[:max_total_bytes - total], True
+                total += len(patch)
+                patches.append((patch, truncated))
+        finally:
+            fetched.close()
+        return patches
+
+    def get_index(self, version: str) -> pathindex.PathIndex:
+        """返回指定版本的路径索引,版本不存在时抛出异常"""
+        res = self.refs.resolve(version)
+        if res is None:
+            raise RuntimeError(f"版本{version}不存在")
+        return pathindex.get_index(self.repo_dir, res.tree)
+
+    def get_entry(self, version: str, path: str):
+        """返回指定版本中path对应的条目,不存在时返回None"""
+        rel_path = normalize_path(path)
+        res = self.get_index(version).entry(rel_path)
+        if res is None:
+            return None
+        mode, type, sha = res
+        size = None
+        if type == "blob":
+            size = self.git.info(sha)[2]
+        return TreeEntry(rel_path.rpartition("/")[2], rel_path, mode, type, sha, size)
+
+    def get_tree(self, version: str, path: str) -> TreeEntry:
+        entry = self.get_entry(version, path)
+        if entry is None or entry.type != "tree":
+            raise RuntimeError(f"目录{path}不存在")
+        return entry
+
+    def get_blob(self, version: str, path: str) -> TreeEntry:
+        entry = self.get_entry(version, path)
+        if entry is None:
+            raise RuntimeError(f"文件{path}不存在")
+        if entry.type != "blob":
+            raise RuntimeError(f"{path}不是一个文件")
+        return entry
+
+    def read_blob(self, version: str, path: str) -> bytes:
+        return self.git.get_blob(self.get_blob(version, path).sha)
+
+    def is_file(self, version: str, path: str) -> bool:
+        return self.get_index(version).is_file(normalize_path(path))
+
+    def is_dir(self, version: str, path: str) -> bool:
+        return self.get_index(version).is_dir(normalize_path(path))
+
+    def read_tree(self, sha: str) -> list:
+        """返回一个tree对象的(name, mode, type, sha, size)条目列表,按名称排序,文件会带上大小"""
+        entries = tree_cache.get(sha)
+        if entries is not None:
+            return entries
+        raw = self.git.get_tree(sha) or []
+        sizes = self.git.info_many([sha for _, type, sha, _ in raw if type == "blob"])
+        sizes.reverse()
+        entries = []
+        for mode, type, sha_, name in raw:
+            size = None
+            if type == "blob":
+                res = sizes.pop()
+                size = res[2] if res is not None else 0
+            entries.append((name, int(mode, 8), type, sha_, size))
+        entries.sort()
+        entries = tuple(entries)
+        tree_cache.put(sha, entries)
+        return entries
+
+    def list_tree(self, tree: TreeEntry) -> list:
+        """返回一个tree条目下的所有子条目,按名称排序,文件会带上大小"""
+        prefix = tree.path + "/" if tree.path else ""
+        return [TreeEntry(name, prefix + name, mode, type, sha, size)
+                for name, mode, type, sha, size in self.read_tree(tree.sha)]
+
+    def walk(self, tree: TreeEntry, max_depth=None, hidden=True):
+        """按名称顺序先序遍历git tree,不超过max_depth层(None表示不限制),hidden为False时跳过以.开头的条目
+
+        产生(lasts, item), lasts记录了item及其每一层祖先是否是所在目录的最后一个条目,
+        len(lasts)就是item的深度
+        """
+        def children_of(tree):
+            children = self.list_tree(tree)
+            if not hidden:
+                children = [c for c in children if not c.name.startswith(".")]
+            return children
+
+        children = children_of(tree)
+        stack = [(iter(children), len(children), 0)]
+        lasts = []
+        while stack:
+            items, count, index = stack[-1]
+            item = next(items, None)
+            if item is None:
+                stack.pop()
+                if lasts:
+                    lasts.pop()
+                continue
+            stack[-1] = (items, count, index + 1)
+            item_lasts = tuple(lasts) + (index == count - 1,)
+            yield item_lasts, item
+            if item.type == "tree" and (max_depth is None or len(item_lasts) < max_depth):
+                children = children_of(item)
+                stack.append((iter(children), len(children), 0))
+                lasts.append(index == count - 1)
+
+    def entry_info(self, entry: TreeEntry) -> dict:
+        """将git条目转换为与list_dir/get_file_meta_info一致的字典"""
+        info = {
+            "name": entry.name,
+            "type": entry_type(entry),
+            "path": "/" + entry.path,
+            "mode": oct(entry.mode),
+            "sha": entry.sha,
+        }
+        if entry.type == "blob":
+            info["size"] = entry.size
+        return info
+
+    def dir_to_dict(self, tree: TreeEntry, max_depth=1, offset=0, limit=None):
+        """将git tree转换为嵌套字典,只包含先序遍历中[offset, offset+limit)范围内的条目
+
+        返回(字典, 下一页的offset), 没有更多条目时下一页的offset为None.
+        在之前的页中出现过的祖先目录会再次出现,以便保持嵌套结构
+        """
+        root = {
+            "name": tree.name,
+            "type": "directory",
+            "path": "/" + tree.path,
+            "sha": tree.sha,
+            "children": [],
+        }
+        # 当前条目的各层祖先目录的字典, 第0层是tree本身
+        parents = [root]
+        ancestors = [tree]
+        for n, (lasts, item) in enumerate(self.walk(tree, max_depth)):
+            depth = len(lasts)
+            del ancestors[depth:]
+            del parents[depth:]
+            if limit is not None and n >= offset + limit:
+                return root, n
+            if n >= offset:
+                # 补齐在之前的页中出现过的祖先目录
+                while len(parents) < depth:
+                    node = self.entry_info(ancestors[len(parents)])
+                    node["children"] = []
+                    parents[-1]["children"].append(node)
+                    parents.append(node)
+                info = self.entry_info(item)
+                if item.type == "tree" and (max_depth is None or depth < max_depth):
+                    info["children"] = []
+                    parents.append(info)
+                parents[depth - 1]["children"].append(info)
+            ancestors.append(item)
+        return root, None
+
+    def render_tree(self, tree: TreeEntry, max_depth=1, offset=0, limit=None):
+        """以类似`tree -h -n -F`的格式输出git tree的目录结构,和tree命令一样不显示以.开头的条目
+
+        只输出先序遍历中[offset, offset+limit)范围内的条目,返回(文本, 下一页的offset),
+        没有更多条目时下一页的offset为None
+        """
+        lines = ["/" + tree.path + ("/" if tree.path else "")] if offset == 0 else []
+        counts = {"directories": 0, "files": 0}
+        next_offset = None
+
+        for n, (lasts, item) in enumerate(self.walk(tree, max_depth, hidden=False)):
+            if n < offset:
+                continue
+            if limit is not None and n >= offset + limit:
+                next_offset = n
+                break
+            prefix = "".join("    " if last else "│   " for last in lasts[:-1])
+            branch = "└── " if lasts[-1] else "├── "
+            if item.type in ("tree", "commit"):
+                counts["directories"] += 1
+                lines.append(f"{prefix}{branch}{item.name}/")
+            else:
+                counts["files"] += 1
+                suffix = ""
+                if item.mode == MODE_SYMLINK:
+                    suffix = "@"
+                elif item.mode & stat.S_IXUSR:
+                    suffix = "*"
+                lines.append(f"{prefix}{branch}[{human_size(item.size)}]  {item.name}{suffix}")
+
+        lines.append("")
+        lines.append(f"{counts['directories']} directories, {counts['files']} files")
+        return "\n".join(lines) + "\n", next_offset
@@ -0,0 +1,65 @@
+#  Join engine matching the blob ids of an identifier against the
+#  manifest of a version.
+#
+#  Two engines are available:
+#    numpy  : vectorized searchsorted over the memory-mapped blob id array
+#    bisect : one binary search per blob id, pure Python
+#  numpy is used when it is installed, LXR_JOIN_ENGINE forces an engine.
+
+import os
+from bisect import bisect_left, bisect_right
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ENGINE = os.environ.get('LXR_JOIN_ENGINE', 'numpy' if numpy is not None else 'bisect')
+
+# Below this number of blob ids, the setup cost of numpy is higher than
+# the cost of a few binary searches
+NUMPY_MIN_IDS = 16
+
+def match_bisect(m, blob_ids):
+    sel = []
+    pos = []
+    ids = m.ids
+    count = m.count
+    for i, blob_id in enumerate(blob_ids):
+        blob_id = int(blob_id)
+        lo = bisect_left(ids, blob_id)
+        if lo == count or ids[lo] != blob_id:
+            continue
+        hi = bisect_right(ids, blob_id, lo)
+        for p in range(lo, hi):
+            sel.append(i)
+            pos.append(p)
+    return sel, pos
+
+def match_numpy(m, blob_ids):
+    ids = m.ids_array()
+    # Byte strings from DefList/RefList entries are parsed in C by astype()
+    query = numpy.asarray(blob_ids).astype(numpy.int64)
+    lo = numpy.searchsorted(ids, query, side='left')
+    hi = numpy.searchsorted(ids, query, side='right')
+    counts = hi - lo
+    matched = numpy.flatnonzero(counts)
+    if len(matched) == 0:
+        return [], []
+    counts = counts[matched]
+    if counts.max() == 1:
+        return matched.tolist(), lo[matched].tolist()
+    # A blob present under several paths matches a range of positions
+    sel = numpy.repeat(matched, counts)
+    starts = numpy.repeat(lo[matched], counts)
+    steps = numpy.arange(len(sel)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    return sel.tolist(), (starts + steps).tolist()
+
+def match(m, blob_ids, engine=None):
+    '''Returns two lists (sel, pos): blob_ids[sel[k]] is the blob id of the
+        file at position pos[k] of manifest m. blob_ids can contain ints or
+        the decimal byte strings stored in the database.'''
+    engine = engine or ENGINE
+    if engine == 'numpy' and numpy is not None and len(blob_ids) >= NUMPY_MIN_IDS:
+        return match_numpy(m, blob_ids)
+    return match_bisect(m, blob_ids)
@@ -21,6 +21,7 @@
 import sys
 import logging
 import subprocess, os
+import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +30,7 @@ CURRENT_DIR = os.path.abspath(os.path.dirname(os.path.abspath(__file__)))
 
 def script(*args, env=None):
     args = (os.path.join(CURRENT_DIR, 'script.sh'),) + args
+    metrics.count_subprocess(args)
     # subprocess.run was introduced in Python 3.5
     # fall back to subprocess.check_output if it's not available
     if hasattr(subprocess, 'run'):
@@ -39,6 +41,7 @@ def script(*args, env=None):
     return p
 
 def run_cmd(*args, env=None):
+    metrics.count_subprocess(args)
     p = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
     if len(p.stderr) != 0:
         logger.error('command %s printed to stderr: \n%s', str(args), p.stderr.decode('utf-8'))
@@ -1,13 +1,17 @@
-import subprocess
 from mcp.server.fastmcp import FastMCP
+import argparse
+import base64
 import json
 import os
 import logging
-import query
-import git 
+import lib
+import metrics
+import profiling
+import projects
+import warmup
+from gitstore import GitStore
+from executor import blocking, running
 from build_resp import build_fail_resp, build_success_resp
-from pathlib import Path
-import time 
 
 logger = logging.getLogger("linux_query_mcp")
 
@@ -19,92 +23,239 @@ settings = {
 mcp = FastMCP("linux-source-code-query", log_level="ERROR", settings=settings)
 LXR_BASE_DIR=os.getenv("LXR_BASE_DIR")
 REPO_DIR=os.getenv("REPO_DIR")
-repo = git.Repo(REPO_DIR)
 
-def get_query(project_name: str) -> query.Query:
-    return query.get_query(LXR_BASE_DIR, project_name)
+# 传输方式: stdio时每个客户端会话启动一个服务进程; sse时一个进程通过HTTP同时服务多个会话,
+# 所有会话共用git进程池,数据库句柄,缓存和LXR_*_CONCURRENCY限定的线程池
+TRANSPORT = os.getenv("LXR_TRANSPORT", "stdio")
+HOST = os.getenv("LXR_HOST", "127.0.0.1")
+PORT = int(os.getenv("LXR_PORT", "8000"))
+# sse时同时打开的会话(/sse连接)数上限,超过时新会话返回503,0表示不限制.
+# 已打开会话的/messages请求不受限制
+MAX_CONNECTIONS = int(os.getenv("LXR_MAX_CONNECTIONS", "0"))
+
+# LXR_BASE_DIR下的所有项目,REPO_DIR可以指定默认项目的git仓库.
+# 仓库和索引数据库都在第一次使用时才打开,berkeleydb和numpy等模块也在第一次查询时才导入,
+# 这样进程启动后可以立即响应客户端的initialize握手和工具列表请求
+registry = projects.Registry(LXR_BASE_DIR, {projects.DEFAULT_PROJECT: REPO_DIR} if REPO_DIR else None)
+
+def get_store(project: str = "") -> GitStore:
+    # 所有对源码的读取都直接访问git对象库,不检出工作区
+    return registry.get(project).get_store()
+
+def get_query(project: str = "") -> "query.Query":
+    # 同一个项目的Query实例和数据库句柄在进程内复用,进程退出时统一关闭
+    return registry.get(project).get_query()
+
+def encode_cursor(*offsets) -> str:
+    """将分页的位置编码为一个不透明的cursor字符串"""
+    return base64.urlsafe_b64encode(",".join(str(o) for o in offsets).encode()).decode()
+
+def decode_cursor(cursor: str, count: int) -> tuple:
+    """解析encode_cursor生成的cursor字符串,返回count个分页位置"""
+    try:
+        offsets = tuple(int(o) for o in base64.urlsafe_b64decode(cursor.encode()).decode().split(","))
+    except ValueError:
+        offsets = ()
+    if len(offsets) != count or any(o < 0 for o in offsets):
+        raise RuntimeError(f"cursor {cursor}无效")
+    return offsets
+
+def ident_contents(res, totals, offsets) -> dict:
+    # SymbolInstance在生成json时直接序列化,不需要先转换为字典
+    contents = {
+        "define": res[0],
+        "reference": res[1],
+        "document": res[2],
+        "total": {
+            "define": totals[0],
+            "reference": totals[1],
+            "document": totals[2]
+        },
+        "next_cursor": None
+    }
+
+    # 每一类结果各自翻页,已经返回完的类别在下一页中为空
+    next_offsets = [min(o + len(r), t) for o, r, t in zip(offsets, res, totals)]
+    if any(o < t for o, t in zip(next_offsets, totals)):
+        contents["next_cursor"] = encode_cursor(*next_offsets)
 
+    return contents
 
 @mcp.tool()
-async def query_ident(version: str, ident: str, family="C") -> str:
+@blocking("cpu")
+def query_ident(version: str, ident: str, family="C", limit: int = 200, offset: int = 0, cursor: str = "", project: str = "") -> str:
     """查询Linux内核代码标识符(identifiers),输入版本号,符号名,和符号类型,返回代码标识符查询结果
     
     Args:
         version (str): 要查询的项目的版本,例如v3.0,v4.10,v5.11等
         ident (str): 要查询的符号名称,例如raw_spin_unlock_irq等
         family (str): 要查询的符号类型. 只有两个值可选:B和C.如果是常规的代码标识符(identifiers)则传入"C". 如果是专门处理设备树(Device Tree)兼容性字符串(compatible strings)则传入"B"
+        limit (int): 每一类结果(define, reference, document)最多返回的条数,默认为200,小于等于0表示不限制. 常用符号的引用可能有上万条,建议分页获取
+        offset (int): 每一类结果从第几条开始返回,默认为0
+        cursor (str): 上一次查询返回的next_cursor,传入后会接着上一页继续返回,此时offset被忽略
+        project (str): 要查询的项目名称,可以用list_projects获取,为空时使用默认项目
     
     Returns:
-        代码标识符(identifiers)查询结果,结果是一个json对象,其中分别有3个键值对,
+        代码标识符(identifiers)查询结果,结果是一个json对象,其中有以下键值对,
         第1个键值对,键是define,值是一个list,表示这个这个符号被定义的信息,每一个元素是一个object,包含了路径(path),行号(line)和这个符号被定义时的类型(type),例如如果type为macro则说明是在宏中被定义,如果是member则说明是作为结构体成员被定义
         第2个键值对,键是reference,值是一个list,表示这个这个符号被引用的信息,每一个元素是一个object,包含了路径(path),行号(line)和这个符号被引用时的类型(type),这个类型一般都为null,可忽略
         第3个键值对,键是document,值是一个list,表示这个这个符号被文档注释的信息,每一个元素是一个object,包含了路径(path),行号(line)和这个符号被定义时的类型(type),这个类型一般都为null,可忽略
+        第4个键值对,键是total,值是一个object,分别给出define, reference, document三类结果的总条数
+        第5个键值对,键是next_cursor,如果还有未返回的结果,值是获取下一页时需要传入的cursor,否则为null
+    """
+    try:
+        q = get_query(project)
+        limit = limit if limit > 0 else None
+        if not cursor and offset < 0:
+            raise RuntimeError(f"offset {offset}无效")
+        offsets = decode_cursor(cursor, 3) if cursor else (offset,) * 3
+        res, totals = q.get_idents(version, ident, family, offsets, limit)
+        contents = ident_contents(res, totals, offsets)
+        return build_success_resp(data=contents, message=f"从{version}的Linux源码中获取标识符{ident}信息成功")
+    
+    except Exception as e:
+        return build_fail_resp(message=f"从{version}的Linux源码中获取标识符{ident}信息失败.失败原因:{e}")
+
+@mcp.tool()
+@blocking("cpu")
+def query_idents(version: str, idents: list[str], families: list[str] | None = None, family="C", limit: int = 50, project: str = "") -> str:
+    """批量查询同一版本中多个Linux内核代码标识符(identifiers),比逐个调用query_ident更快
+    
+    Args:
+        version (str): 要查询的项目的版本,例如v3.0,v4.10,v5.11等
+        idents (list[str]): 要查询的符号名称列表,例如["raw_spin_lock", "raw_spin_unlock"]
+        families (list[str]): 每个符号各自的符号类型,与idents一一对应,可选值与query_ident的family相同.为空时所有符号都使用family
+        family (str): families为空时所有符号使用的符号类型,默认为"C"
+        limit (int): 每个符号每一类结果(define, reference, document)最多返回的条数,默认为50,小于等于0表示不限制. 需要更多结果时用query_ident和返回的next_cursor分页获取
+        project (str): 要查询的项目名称,可以用list_projects获取,为空时使用默认项目
+    
+    Returns:
+        批量查询结果,结果是一个json对象,键是符号名称,值与query_ident返回的结果格式相同,
+        包含define, reference, document, total和next_cursor,其中next_cursor可以传给query_ident继续获取该符号的下一页
+    """
+    try:
+        if families and len(families) != len(idents):
+            raise RuntimeError("families和idents的长度不一致")
+        q = get_query(project)
+        limit = limit if limit > 0 else None
+        families = families or [family] * len(idents)
+        offsets = (0, 0, 0)
+        results = q.get_idents_many(version, list(zip(idents, families)), offsets, limit)
+        contents = {}
+        for ident, (res, totals) in zip(idents, results):
+            contents[ident] = ident_contents(res, totals, offsets)
+
+        return build_success_resp(data=contents, message=f"从{version}的Linux源码中批量获取{len(idents)}个标识符信息成功")
+
+    except Exception as e:
+        return build_fail_resp(message=f"从{version}的Linux源码中批量获取标识符信息失败.失败原因:{e}")
+
+@mcp.tool()
+@blocking("cpu")
+def query_ident_history(ident: str, from_version: str, to_version: str, family="C", max_versions: int = 50, limit: int = 100, project: str = "") -> str:
+    """查询一个Linux内核代码标识符(identifiers)在一段版本范围内的变化历史,一次调用代替对每个版本分别调用query_ident
+    
+    Args:
+        ident (str): 要查询的符号名称,例如raw_spin_unlock_irq等
+        from_version (str): 版本范围的起始版本(包含),例如v5.10
+        to_version (str): 版本范围的结束版本(包含),例如v5.15
+        family (str): 要查询的符号类型,默认为"C",不支持设备树兼容性字符串"B"
+        max_versions (int): 最多返回的版本个数,默认为50,超过时可以把返回的next_from_version作为from_version继续查询
+        limit (int): 每个版本每一类变化(define, reference, document)最多返回的条数,默认为100,小于等于0表示不限制
+        project (str): 要查询的项目名称,可以用list_projects获取,为空时使用默认项目
+    
+    Returns:
+        变化历史,结果是一个json对象,其中有以下键值对,
+        第1个键值对,键是history,值是一个list,按版本从旧到新排列,每一个元素是一个object,包含:
+            version: 版本号
+            total: 该版本中define, reference, document三类结果的总条数
+            added: 与前一个版本相比新增的define, reference, document,第一个版本相当于该版本的全部结果
+            removed: 与前一个版本相比消失的define, reference, document
+            truncated: 如果added或removed中有结果因为limit没有返回,值为true
+        第2个键值对,键是next_from_version,如果版本范围内还有未返回的版本,值是下一个版本号,否则为null
     """
     try:
-        q = get_query("linux")
-        res = q.query("ident", version, ident, family)
+        if family == "B":
+            raise RuntimeError("不支持查询设备树兼容性字符串的历史")
+        q = get_query(project)
+        versions = q.indexed_versions()
+        for v in (from_version, to_version):
+            if v not in versions:
+                raise RuntimeError(f"版本{v}不存在或没有被索引")
+        start, end = versions.index(from_version), versions.index(to_version)
+        if start > end:
+            raise RuntimeError(f"版本{from_version}比{to_version}新")
+        versions = versions[start:end+1]
+        max_versions = max(max_versions, 1)
+        limit = limit if limit > 0 else None
         contents = {
-            "define": [],
-            "reference": [],
-            "document": []
+            "history": [],
+            "next_from_version": versions[max_versions] if len(versions) > max_versions else None
         }
 
-        for it in res[0]:
-            contents["define"].append(it.to_dict())
-
-        for it in res[1]:
-            contents["reference"].append(it.to_dict())
+        sections = ("define", "reference", "document")
+        for version, totals, added, removed in q.get_ident_history(ident, family, versions[:max_versions]):
+            truncated = limit is not None and any(len(s) > limit for s in added + removed)
+            contents["history"].append({
+                "version": version,
+                "total": dict(zip(sections, totals)),
+                "added": {k: s[:limit] for k, s in zip(sections, added)},
+                "removed": {k: s[:limit] for k, s in zip(sections, removed)},
+                "truncated": truncated
+            })
 
-        for it in res[2]:
-            contents["document"].append(it.to_dict())
+        return build_success_resp(data=contents, message=f"从{from_version}到{to_version}的Linux源码中获取标识符{ident}的历史成功")
 
-        return build_success_resp(data=contents, message=f"从{version}的Linux源码中获取标识符{ident}信息成功")
-    
     except Exception as e:
-        return build_fail_resp(message=f"从{version}的Linux源码中获取标识符{ident}信息失败.失败原因:{e}")
+        return build_fail_resp(message=f"从{from_version}到{to_version}的Linux源码中获取标识符{ident}的历史失败.失败原因:{e}")
 
 @mcp.tool()
-async def get_tags() -> str:
+@blocking("git")
+def get_tags(project: str = "") -> str:
     """查询Linux内核代码的所有tags,返回当前源码所有的tags
     
     Args:
-        无
+        project (str): 要查询的项目名称,可以用list_projects获取,为空时使用默认项目
     
     Returns:
         返回一个json数组,其中每一项是一个标签名,例如[v1.0, v4.10, v6.6]
     """
     try:
-        resp = []
-        for tag in repo.tags:
-            resp.append(tag.name)
+        resp = get_store(project).get_tags().names
         return build_success_resp(data=resp, message="查询Linux内核代码所有tags成功")
     except Exception as e:
         return build_fail_resp(message=f"查询Linux内核代码所有tags失败,失败原因:{e}")
 
 @mcp.tool()
-async def get_versions() -> str:
+@blocking("git")
+def get_versions(project: str = "") -> str:
     """查询Linux内核代码的所有版本,返回Linux内核源码所有版本号
     
     Args:
-        无
+        project (str): 要查询的项目名称,可以用list_projects获取,为空时使用默认项目
     
     Returns:
         返回一个json数组,其中每一项是一个版本名,例如[v1.0, v4.10, v6.6]
     """
     try:
-        resp = []
-        for tag in repo.tags:
-            resp.append(tag.name)
+        resp = get_store(project).get_tags().names
         return build_success_resp(data=resp, message="查询Linux内核代码所有版本成功")
     except Exception as e:
         return build_fail_resp(message=f"查询Linux内核代码所有版本失败,失败原因:{e}")
 
 @mcp.tool()
-async def get_commit_info(commit_id: str):
+@blocking("git")
+def get_commit_info(commit_id: str, patch: bool = True, limit: int = 100, cursor: str = "", max_patch_bytes: int = 20000, max_total_bytes: int = 200000, project: str = ""):
     """获取Linux内核源码指定commit的信息,输入commit的hash id,返回该commit的相关信息
 
     Args:
         commit_id (str) : commit的id字符串  
+        patch (bool) : 是否返回每个文件被修改的具体内容,为False时只返回修改的文件列表和增删行数,默认为True
+        limit (int) : 每次最多返回的被修改文件数,默认为100,小于等于0表示不限制. 合并commit或大范围修改的commit可能修改了上万个文件,建议分页获取
+        cursor (str) : 上一次调用返回的next_cursor,传入后会接着上一页继续返回被修改的文件
+        max_patch_bytes (int) : 每个文件的修改内容最多返回的字节数,默认为20000,超出部分被截断
+        max_total_bytes (int) : 本页所有文件的修改内容合计最多返回的字节数,默认为200000,超出后剩余文件不再返回修改内容
+        project (str) : 要查询的项目名称,可以用list_projects获取,为空时使用默认项目
 
     Returns:
         返回一个包含commit的信息json字符串,其中包含以下字段:
@@ -114,111 +265,57 @@ async def get_commit_info(commit_id: str):
             date:当前commit提交的日期
             message:当前commit提交时附加的信息
             parrent_commit_hash:当前commit的父commit的hash id
-            diffs:当前commit相比于父commit的改变的列表,列表中每一个元素都是一个文件改变的信息,具体来说包含了以下信息
+            total_files:当前commit相比于第一个父commit修改的文件总数
+            diffs:当前commit相比于第一个父commit的改变的列表,列表中每一个元素都是一个文件改变的信息,具体来说包含了以下信息
                 diff_file:在本次commit中被修改的文件名
-                diff_change_type:本次commit中,该文件被修改的类型,例如新增,修改,删除
-                diff_change_content:本次commit中,该文件被修改的具体内容,其中'+'表示新增,'-'表示删除,与.diff文件解析方式类似
+                diff_old_file:文件被重命名或复制时的原文件名,其他情况为null
+                diff_change_type:本次commit中,该文件被修改的类型,A表示新增,M表示修改,D表示删除,R表示重命名,C表示复制,T表示类型改变
+                insertions:新增的行数,二进制文件为null
+                deletions:删除的行数,二进制文件为null
+                diff_change_content:本次commit中,该文件被修改的具体内容,其中'+'表示新增,'-'表示删除,与.diff文件解析方式类似. 只有patch为True时才有该字段,超出总字节数限制时为null
+                truncated:diff_change_content是否被截断,只有patch为True时才有该字段
+            next_cursor:如果还有未返回的被修改文件,值是获取下一页时需要传入的cursor,否则为null
     """
     try:
-        repo.git.checkout(commit_id)
-
-        # 获取当前commit的log信息
-        commit = repo.head.commit
+        # 直接从对象库中读取commit,不检出. 结果按commit的完整sha缓存
+        info = get_store(project).commit_info(commit_id)
+        offset, = decode_cursor(cursor, 1) if cursor else (0,)
+        end = offset + limit if limit > 0 else None
+        changes = info["changes"][offset:end]
         resp = {
-            "commit_hash": commit.hexsha,
-            "author": commit.author.name,
-            "author_email": commit.author.email,
-            "date": commit.authored_datetime,
-            "message": commit.message.strip(),
-            "parrent_commit_hash": [],
-            "diffs": []
+            "commit_hash": info["sha"],
+            "author": info["author"],
+            "author_email": info["author_email"],
+            "date": info["date"],
+            "message": info["message"],
+            "parrent_commit_hash": info["parents"],
+            "total_files": len(info["changes"]),
+            "diffs": [],
+            "next_cursor": None
         }
+        if end is not None and end < len(info["changes"]):
+            resp["next_cursor"] = encode_cursor(end)
 
-        # 获取该commit的父commit信息
-        for parent in commit.parents:
-            resp['parrent_commit_hash'].append(parent.hexsha)
-        
-        # 获取该commit与父commit的差异
-        if len(commit.parents) > 0:
-            parent = commit.parents[0]
-            diffs = parent.diff(commit, create_patch=True)
-        else:
-            # 初始commit没有父节点
-            diffs = commit.diff(git.NULL_TREE, create_patch=True)
-        
-        # 展示每个修改的文件和diff
-        for diff in diffs:
+        if patch:
+            patches = get_store(project).commit_patches(info, changes, max(max_patch_bytes, 0), max(max_total_bytes, 0))
+        for i, change in enumerate(changes):
             diff_tmp = {}
-            diff_tmp["diff_file"] = diff.a_path if diff.a_path else diff.b_path
-            diff_tmp["diff_change_type"] = diff.change_type
-            if hasattr(diff, 'diff'):
-                diff_tmp["diff_change_content"] = diff.diff.decode('utf-8') if isinstance(diff.diff, bytes) else diff.diff
+            diff_tmp["diff_file"] = change.path
+            diff_tmp["diff_old_file"] = change.old_path
+            diff_tmp["diff_change_type"] = change.change_type
+            diff_tmp["insertions"] = change.insertions
+            diff_tmp["deletions"] = change.deletions
+            if patch:
+                diff_tmp["diff_change_content"], diff_tmp["truncated"] = patches[i]
             resp["diffs"].append(diff_tmp)
 
         return build_success_resp(data=resp, message=f"查询Linux内核源码id为{commit_id}的commit成功")
     except Exception as e:
         return build_fail_resp(message=f"查询Linux内核源码id为{commit_id}的commit失败,失败原因:{e}")
 
-
-def dir_to_dict(path):
-    """将目录结构转换为嵌套字典"""
-    path = Path(path)
-    if not path.exists():
-        return None
-    
-    info = {
-        'name': path.name,
-        'type': 'directory',
-        'path': str(path.resolve()),
-        'size': path.stat().st_size,
-        "create_time": time.ctime(path.stat().st_ctime),
-        'children': []
-    }
-    
-    for item in path.iterdir():
-        if item.is_dir():
-            info['children'].append(dir_to_dict(item))
-        else:
-            info['children'].append({
-                "name": item.name,
-                "type": "file",
-                "path": str(item.resolve()),
-                "size": item.stat().st_size,
-                "create_time": time.ctime(item.stat().st_ctime),
-                "last_monify_time": time.ctime(item.stat().st_mtime),
-                "last_access_time": time.ctime(item.stat().st_atime),
-            })
-    
-    return info
-
-def execute_tree_command(path: str, recursive=False):
-    """
-    执行系统tree命令并返回输出
-    
-    参数:
-        path (str): 要显示树结构的目录路径,默认为当前目录
-        
-    返回:
-        str: tree命令的输出结果
-    """
-    cmd = []
-    if recursive:
-        cmd = ['tree', '-h' ,'-n', '-F', path]
-    else:
-        cmd = ['tree', '-h' ,'-n', '-F', '-L', '1', path]
-    # 执行tree命令并捕获输出
-    result = subprocess.run(cmd, 
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            text=True)
-    
-    if result.returncode == 0:
-        return result.stdout
-    else:
-        raise RuntimeError(f"执行tree命令出错: {result.stderr}")
-
 @mcp.tool()
-async def list_dir(version: str, path: str, detail = False, recursive=False) -> str:
+@blocking("git")
+def list_dir(version: str, path: str, detail = False, recursive=False, max_depth: int = 0, limit: int = 1000, cursor: str = "", project: str = "") -> str:
     """展示Linux内核源码中某一个目录的内容,输入内核版本号或commit id,要展示的目录相对Linux内核源码根目录的路径,返回该目录中的内容信息
 
     Args:
@@ -226,78 +323,58 @@ async def list_dir(version: str, path: str, detail = False, recursive=False) ->
         path (str) : 要查看的Linux内核源码中的目录路径,这个路径是相对于内核源码根目录的路径,例如: /arch, /drivers/gpu/
         detail (bool) : 是否展示更详细的信息,如果为True,那么该函数就会尽可能详细地返回查询结果,这可能会非常大。如果是False,则函数会返回较为精简的结果,默认为False
         recursive (bool) : 是否递归地展示待查询目录的内容,如果是True,那么函数就会递归地返回该目录所有的子文件和子目录。如果是False,那么函数就只会返回该目录下的子文件和子目录,不会再进行递归查找
+        max_depth (int) : recursive为True时最多展开的目录层数,例如2表示只展示子目录的内容,不再继续深入,小于等于0表示不限制,默认为0
+        limit (int) : 最多返回的条目数,默认为1000,小于等于0表示不限制. 递归展示大目录时结果可能非常大,建议分页获取
+        cursor (str) : 上一次调用返回的next_cursor,传入后会接着上一页继续返回
+        project (str) : 要查询的项目名称,可以用list_projects获取,为空时使用默认项目
 
     Returns:
-        如果detail == False,则返回一个由tree命令生成的字符串来展示目录结构
+        如果detail == False,则返回一个类似tree命令输出的字符串来展示目录结构,如果还有未返回的条目,最后一行会给出获取下一页时需要传入的cursor
 
         如果detail == True,则返回一个json字符串,其中包含了以下字段:
             name : 待查找的项目的名称
             type : 待查找的项目的类型
                     directory -> 目录
                     file -> 文件
-            path : 待查找的项目的绝对路径
-            size : 待查找的项目的大小(bytes)
-            create : 待查找的项目的创建时间
-            last_monify_time : 待查找的项目最近一次修改时间
-            last_access_time : 待查找的项目最近一次被访问时间
-            children : 待查找的项目如果是一个目录的话,这里会存放该目录下的所有子项目
+                    submodule -> git子模块
+            path : 待查找的项目相对于内核源码根目录的路径
+            mode : 待查找的项目在git中的文件模式,例如0o100644
+            sha : 待查找的项目在git中的对象id
+            size : 待查找的项目的大小(bytes),只有文件才有该字段
+            children : 待查找的项目如果是一个目录的话,这里会存放该目录下的子项目. 分页时之前的页中出现过的上级目录会再次出现,以保持嵌套结构
+            next_cursor : 如果还有未返回的条目,值是获取下一页时需要传入的cursor,否则为null
     """
     try:
-        repo.git.checkout(version)
-        abs_path = Path(f"{REPO_DIR}/{path}")
-        if not abs_path.is_dir():
-            raise RuntimeError(f"目录{abs_path}不存在")
-        
+        tree = get_store(project).get_tree(version, path)
+        if not recursive:
+            max_depth = 1
+        max_depth = max_depth if max_depth > 0 else None
+        limit = limit if limit > 0 else None
+        offset, = decode_cursor(cursor, 1) if cursor else (0,)
+
         if detail:
-            info = {
-                'name': abs_path.name,
-                'type': 'directory',
-                'path': str(abs_path.resolve()),
-                'size': abs_path.stat().st_size,
-                "create_time": time.ctime(abs_path.stat().st_ctime),
-                'children': [] 
-            }
-
-            if recursive:
-                info = dir_to_dict(abs_path)
-            else:
-                for item in abs_path.iterdir():
-                    if item.is_file():
-                        info['children'].append({
-                            "name": item.name,
-                            "type": "file",
-                            "path": str(item.resolve()),
-                            "size": item.stat().st_size,
-                            "create_time": time.ctime(item.stat().st_ctime),
-                            "last_monify_time": time.ctime(item.stat().st_mtime),
-                            "last_access_time": time.ctime(item.stat().st_atime),
-                        })
-                    elif item.is_dir():
-                        info['children'].append({
-                            "name": item.name,
-                            "type": "directory",
-                            "path": str(item.resolve()),
-                            "create_time": time.ctime(item.stat().st_ctime),
-                        })
+            info, next_offset = get_store(project).dir_to_dict(tree, max_depth, offset, limit)
+            info["next_cursor"] = encode_cursor(next_offset) if next_offset is not None else None
             return build_success_resp(data=info, message=f"展示目录{path}内容成功")
 
         else:
-            info = execute_tree_command(path=str(abs_path.resolve()),recursive=recursive)
+            info, next_offset = get_store(project).render_tree(tree, max_depth, offset, limit)
+            if next_offset is not None:
+                info += f"还有更多条目,传入cursor={encode_cursor(next_offset)}继续获取\n"
             return f"{path}的目录结构如下：\n{info}"
 
-    except FileNotFoundError:
-        return build_fail_resp(message=f"展示目录{path}内容失败,失败原因: 系统未安装tree命令,请先安装tree工具")
-    
     except Exception as e:
         return build_fail_resp(message=f"展示目录{path}内容失败,失败原因:{e}")
 
 @mcp.tool()
-async def get_file_meta_info(version: str, path: str):
+@blocking("git")
+def get_file_meta_info(version: str, path: str, project: str = ""):
     """获取Linux内核源码中指定文件的元数据
     
     Args:
         version (str) : 要查看的Linux内核版本,可以是一个具体的版本号,如v4.10,也可以是一个commit的hash id
         path (str) : 要查看的Linux内核源码中某个文件的路径,这个路径是相对于内核源码根目录的路径,例如 /drivers/gpu/drm/amd/amdgpu/aldebaran_reg_init.c
+        project (str) : 要查询的项目名称,可以用list_projects获取,为空时使用默认项目
 
     Returns:
         返回该文件的元数据,包含以下信息:
@@ -305,30 +382,14 @@ async def get_file_meta_info(version: str, path: str):
             type : 文件的类型
                     directory -> 目录
                     file -> 文件
-            path : 文件的绝对路径
+            path : 文件相对于内核源码根目录的路径
+            mode : 文件在git中的文件模式,例如0o100644
+            sha : 文件在git中的blob id
             size : 文件的大小(bytes)
-            create : 文件的创建时间
-            last_monify_time : 文件最近一次修改时间
-            last_access_time : 文件最近一次被访问时间
     """
     try:
-        repo.git.checkout(version)
-        abs_path = Path(f"{REPO_DIR}/{path}")
-        if not abs_path.exists():
-            raise RuntimeError(f"文件{abs_path}不存在")
-
-        if not abs_path.is_file():
-            raise RuntimeError(f"{abs_path}不是一个文件")
-        
-        info = {
-            'name': abs_path.name,
-            'type': 'file',
-            'path': str(abs_path.resolve()),
-            'size': abs_path.stat().st_size,
-            "create_time": time.ctime(abs_path.stat().st_ctime),
-            "last_monify_time": time.ctime(abs_path.stat().st_mtime),
-            "last_access_time": time.ctime(abs_path.stat().st_atime),
-        }
+        blob = get_store(project).get_blob(version, path)
+        info = get_store(project).entry_info(blob)
 
         return build_success_resp(data=info, message=f"获取文件{path}元信息成功")
 
@@ -336,26 +397,20 @@ async def get_file_meta_info(version: str, path: str):
         return build_fail_resp(message=f"获取文件{path}元信息失败,失败原因:{e}")
 
 @mcp.tool()
-async def get_file_content(version: str, path: str) -> str:
+@blocking("git")
+def get_file_content(version: str, path: str, project: str = "") -> str:
     """获取Linux内核源码中指定文件的内容
     
     Args:
         version (str) : 要查看的Linux内核版本,可以是一个具体的版本号,如v4.10,也可以是一个commit的hash id
         path (str) : 要查看的Linux内核源码文件的路径,这个路径是相对于内核源码根目录的路径,例如 /drivers/gpu/drm/amd/amdgpu/aldebaran_reg_init.c
+        project (str) : 要查询的项目名称,可以用list_projects获取,为空时使用默认项目
 
     Returns:
         返回该文件的内容
     """
     try:
-        repo.git.checkout(version)
-        abs_path = Path(f"{REPO_DIR}/{path}")
-        if not abs_path.exists():
-            raise RuntimeError(f"文件{abs_path}不存在")
-
-        if not abs_path.is_file():
-            raise RuntimeError(f"{abs_path}不是一个文件")
-        
-        info = abs_path.read_text()
+        info = lib.decode(get_store(project).read_blob(version, path))
 
         # return build_success_resp(data=info, message=f"获取文件{path}内容成功")
         return f"文件{path}的内容如下：{info}"
@@ -364,22 +419,22 @@ async def get_file_content(version: str, path: str) -> str:
         return build_fail_resp(message=f"获取文件{path}内容失败,失败原因:{e}")
 
 @mcp.tool()
-async def check_if_file_exist(version: str, path: str):
+@blocking("git")
+def check_if_file_exist(version: str, path: str, project: str = ""):
     """查看Linux内核源码中指定文件是否存在
     
     Args:
         version (str) : 要查看的Linux内核版本,可以是一个具体的版本号,如v4.10,也可以是一个commit的hash id
         path (str) : 要查看的Linux内核源码文件的路径,这个路径是相对于内核源码根目录的路径,例如 /drivers/gpu/drm/amd/amdgpu/aldebaran_reg_init.c
+        project (str) : 要查询的项目名称,可以用list_projects获取,为空时使用默认项目
 
     Returns:
         返回该文件是否存在的信息
     """
     try:
-        repo.git.checkout(version)
-        abs_path = Path(f"{REPO_DIR}/{path}")
         message = ""
         result = False
-        if not abs_path.is_file():
+        if not get_store(project).is_file(version, path):
             message = f"文件{path}不存在"
         else:
             result = True
@@ -391,22 +446,22 @@ async def check_if_file_exist(version: str, path: str):
         return build_fail_resp(message=f"查询文件{path}失败,失败原因:{e}")
 
 @mcp.tool()
-async def check_if_directory_exist(version: str, path: str):
+@blocking("git")
+def check_if_directory_exist(version: str, path: str, project: str = ""):
     """查看Linux内核源码中指定目录是否存在
     
     Args:
         version (str) : 要查看的Linux内核版本,可以是一个具体的版本号,如v4.10,也可以是一个commit的hash id
         path (str) : 要查看的Linux内核源码目录的路径,这个路径是相对于内核源码根目录的路径,例如 /drivers/gpu/drm/amd/amdgpu/
+        project (str) : 要查询的项目名称,可以用list_projects获取,为空时使用默认项目
 
     Returns:
         返回该目录是否存在的信息
     """
     try:
-        repo.git.checkout(version)
-        abs_path = Path(f"{REPO_DIR}/{path}")
         message = ""
         result = False
-        if not abs_path.is_dir():
+        if not get_store(project).is_dir(version, path):
             message = f"目录{path}不存在"
         else:
             result = True
@@ -418,45 +473,168 @@ async def check_if_directory_exist(version: str, path: str):
         return build_fail_resp(message=f"查询目录{path}失败,失败原因:{e}")
 
 @mcp.tool()
-async def check_if_commit_exist(commit_id: str):
+@blocking("git")
+def check_if_commit_exist(commit_id: str, project: str = ""):
     """查看Linux内核源码中指定commit是否存在
     
     Args:
         commit_id (str) : 要查看的Linux内核源码的commit id,可以是一个具体的版本号,如v4.10,也可以是一个commit的hash id
+        project (str) : 要查询的项目名称,可以用list_projects获取,为空时使用默认项目
 
     Returns:
         返回该commit是否存在的信息
     """
-    message = f"id为{commit_id}的commit存在"
-    result = True
     try:
-        repo.git.checkout(commit_id)
+        message = f"id为{commit_id}的commit存在"
+        result = True
+        if not get_store(project).commit_exists(commit_id):
+            message = f"id为{commit_id}的commit不存在"
+            result = False
+        return build_success_resp(data=result, message=message)
     except Exception as e:
-        message = f"id为{commit_id}的commit不存在"
-        result = False
-    return build_success_resp(data=result, message=message)
+        return build_fail_resp(message=f"查询commit {commit_id}失败,失败原因:{e}")
 
 @mcp.tool()
-async def check_if_version_exist(version: str):
+@blocking("git")
+def check_if_version_exist(version: str, project: str = ""):
     """查看Linux内核源码中指定版本是否存在
     
     Args:
         version (str) : 要查看的Linux内核源码的指定版本,可以是一个具体的版本号,如v4.10
+        project (str) : 要查询的项目名称,可以用list_projects获取,为空时使用默认项目
 
     Returns:
         返回该版本是否存在的信息
     """
-    message = f"Linux内核源码版本{version}存在"
-    result = True
     try:
-        repo.git.checkout(version)
+        message = f"Linux内核源码版本{version}存在"
+        result = True
+        if not get_store(project).commit_exists(version):
+            message = f"Linux内核源码版本{version}不存在"
+            result = False
+        return build_success_resp(data=result, message=message)
     except Exception as e:
-        message = f"Linux内核源码版本{version}不存在"
-        result = False
-    return build_success_resp(data=result, message=message)
+        return build_fail_resp(message=f"查询版本{version}失败,失败原因:{e}")
+
+@mcp.tool()
+@blocking("git")
+def list_projects() -> str:
+    """列出本服务可以查询的所有项目,例如linux, u-boot等,其他工具通过project参数选择项目
+    
+    Returns:
+        返回一个json数组,其中每一项是一个项目,包含以下字段:
+            name : 项目名称,作为其他工具的project参数
+            indexed : 项目是否有标识符索引,没有索引时不能使用query_ident等标识符查询工具
+            default : 是否是project参数为空时使用的默认项目
+    """
+    try:
+        resp = [p.info() for p in registry.list()]
+        return build_success_resp(data=resp, message="查询所有项目成功")
+    except Exception as e:
+        return build_fail_resp(message=f"查询所有项目失败,失败原因:{e}")
+
+@mcp.tool()
+@blocking("cpu")
+def get_server_metrics() -> str:
+    """获取本服务的运行指标,用于排查性能问题
+    
+    Returns:
+        一个json对象,包含以下字段:
+            enabled : 是否启用了指标记录(环境变量LXR_METRICS=1),未启用时只有caches有数据
+            uptime : 服务运行的秒数
+            counters : 计数器,例如subprocess.git ls-tree为启动的git子进程数,bdb.get.definitions为Berkeley DB查询次数,tool_bytes.query_ident为工具返回的字节数
+            histograms : 耗时分布(秒),例如tool.query_ident为每个工具的耗时,包含count, sum, mean, max, p50, p95, p99和各区间的次数buckets
+            caches : 每个缓存的条目数,占用字节数,命中次数,未命中次数和命中率
+            profiles : 性能分析的设置(settings)和最近被分析的调用(recent),包含工具名称,参数,耗时,内存峰值,分析文件路径和自身耗时最多的函数
+    """
+    try:
+        return build_success_resp(data=metrics.snapshot(), message="获取服务运行指标成功")
+    except Exception as e:
+        return build_fail_resp(message=f"获取服务运行指标失败,失败原因:{e}")
+
+@mcp.tool()
+@blocking("cpu")
+def set_profiling(every: int = -1, slow_ms: float = -1) -> str:
+    """设置对工具调用的性能分析(cProfile和tracemalloc),用于排查偶尔很慢的调用. 分析结果写入LXR_PROFILE_DIR目录,最近的结果摘要出现在get_server_metrics返回的profiles中
+    
+    Args:
+        every (int): 每个工具每隔多少次调用分析一次,0表示关闭,小于0表示不修改当前设置
+        slow_ms (float): 保存耗时超过多少毫秒的调用的分析结果,0表示关闭,小于0表示不修改当前设置. 设置后每一次调用都会被分析,所有调用都会变慢,排查完毕后应关闭
+    
+    Returns:
+        一个json对象,包含当前的every, slow_ms设置和保存分析结果的目录dir
+    """
+    try:
+        settings = profiling.configure(every if every >= 0 else None, slow_ms if slow_ms >= 0 else None)
+        return build_success_resp(data=settings, message="设置性能分析成功")
+    except Exception as e:
+        return build_fail_resp(message=f"设置性能分析失败,失败原因:{e}")
+
+@mcp.resource("metrics://server", mime_type="application/json")
+def server_metrics_resource() -> str:
+    """本服务的运行指标,内容与get_server_metrics工具相同"""
+    return build_success_resp(data=metrics.snapshot(), message="获取服务运行指标成功")
+
+def limit_sessions(app, max_sessions: int):
+    """包装sse的ASGI应用,同时打开的/sse会话超过max_sessions时返回503"""
+    from starlette.responses import PlainTextResponse
+    sessions = 0
+
+    async def limited(scope, receive, send):
+        nonlocal sessions
+        if scope["type"] != "http" or scope["path"] != mcp.settings.sse_path:
+            return await app(scope, receive, send)
+        if sessions >= max_sessions:
+            metrics.count("sse.rejected")
+            response = PlainTextResponse(f"会话数已达到上限{max_sessions}", status_code=503)
+            return await response(scope, receive, send)
+        sessions += 1
+        closed = False
+
+        # 客户端断开后会话的任务不一定立即结束,收到断开消息时就释放名额
+        def close():
+            nonlocal sessions, closed
+            if not closed:
+                closed = True
+                sessions -= 1
+
+        async def receive_closing():
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                close()
+            return message
+
+        try:
+            return await app(scope, receive_closing, send)
+        finally:
+            close()
+    return limited
+
+def run_sse(host: str, port: int, max_sessions: int):
+    import anyio
+    import uvicorn
+    app = mcp.sse_app()
+    if max_sessions > 0:
+        app = limit_sessions(app, max_sessions)
+    # 客户端断开后sse会话的任务不一定结束,退出时最多等待5秒
+    config = uvicorn.Config(app, host=host, port=port, log_level="error", timeout_graceful_shutdown=5)
+    anyio.run(uvicorn.Server(config).serve)
 
 def main():
-    mcp.run(transport="stdio")
+    parser = argparse.ArgumentParser(description="Elixir Linux MCP Server")
+    parser.add_argument("--transport", choices=["stdio", "sse"], default=TRANSPORT, help="传输方式,默认为LXR_TRANSPORT或stdio")
+    parser.add_argument("--host", default=HOST, help="sse时监听的地址")
+    parser.add_argument("--port", type=int, default=PORT, help="sse时监听的端口")
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS, help="sse时同时打开的会话数上限,0表示不限制")
+    args = parser.parse_args()
+
+    metrics.start_dump()
+    # 可选的后台预热默认项目,只在没有请求执行时进行
+    warmup.start(get_query, get_store, lambda: running() > 0)
+    if args.transport == "sse":
+        run_sse(args.host, args.port, args.max_connections)
+    else:
+        mcp.run(transport="stdio")
 
 if __name__ == "__main__":
     main()
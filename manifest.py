@@ -0,0 +1,201 @@
+#  Compact per-version file manifests built from versions.db.
+#
+#  A manifest stores the PathList of a version as flat arrays:
+#    ids     : blob id of every file, sorted as in versions.db (by blob id)
+#    offsets : start of every path in the path pool, plus the end of the pool
+#    ranks   : position of every file when the version is sorted by path
+#    pool    : all paths, concatenated
+#  Lookups binary-search the blob ids and only decode the matching paths.
+#  Manifests are written once to LXR_CACHE_DIR and memory-mapped, so that
+#  several server processes share the same pages. The cache directory is
+#  private to the user (mode 0700) and manifests owned by another user are
+#  ignored, since they are trusted once loaded.
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from urllib import parse
+
+import data
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get('LXR_CACHE_DIR') or os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'elixir-mcp')
+
+# Number of manifests kept open per process
+MAX_OPEN = int(os.environ.get('LXR_MANIFEST_CACHE', '64'))
+
+# Arrays are stored in native byte order: the cache is local to the machine
+MAGIC = b'LXRMAN1' + (b'L' if sys.byteorder == 'little' else b'B')
+HEADER = struct.Struct('=8sIIqq')
+
+class Manifest:
+    '''Read-only view over a manifest buffer (a memory map or bytes).'''
+    def __init__(self, buf):
+        self.buf = buf
+        magic, count, pool_size, mtime, size = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or len(buf) != HEADER.size + 4*count + 4*(count+1) + 4*count + pool_size:
+            raise ValueError('invalid manifest')
+        self.count = count
+        self.stamp = (mtime, size)
+        view = memoryview(buf)
+        pos = HEADER.size
+        self.ids = view[pos:pos + 4*count].cast('I')
+        pos += 4*count
+        self.offsets = view[pos:pos + 4*(count+1)].cast('I')
+        pos += 4*(count+1)
+        self.ranks = view[pos:pos + 4*count].cast('I')
+        pos += 4*count
+        self.pool = view[pos:pos + pool_size]
+        self.ids_np = None
+
+    def __len__(self):
+        return self.count
+
+    # Positions of the files whose blob id is blob_id (a blob can appear
+    # under several paths in the same version)
+    def find(self, blob_id):
+        lo = bisect_left(self.ids, blob_id)
+        if lo == self.count or self.ids[lo] != blob_id:
+            return range(0)
+        return range(lo, bisect_right(self.ids, blob_id, lo))
+
+    # Blob ids as a numpy array sharing the manifest buffer
+    def ids_array(self):
+        if self.ids_np is None:
+            import numpy
+            self.ids_np = numpy.frombuffer(self.buf, dtype=numpy.uint32,
+                                           count=self.count, offset=HEADER.size)
+        return self.ids_np
+
+    def path(self, pos):
+        return bytes(self.pool[self.offsets[pos]:self.offsets[pos+1]]).decode()
+
+    def rank(self, pos):
+        return self.ranks[pos]
+
+    # Same output as PathList.iter()
+    def iter(self, dummy=False):
+        for pos in range(self.count):
+            yield self.ids[pos], self.path(pos)
+        if dummy:
+            yield data.maxId, None
+
+    def close(self):
+        self.ids_np = None
+        for view in (self.ids, self.offsets, self.ranks, self.pool):
+            view.release()
+        if isinstance(self.buf, mmap.mmap):
+            self.buf.close()
+
+def build(pathlist, stamp=(0, 0)):
+    '''Serialize the raw versions.db value of a version into manifest bytes.'''
+    ids = array('I')
+    offsets = array('I', [0])
+    paths = []
+    pool_size = 0
+    for line in pathlist.split(b'\n')[:-1]:
+        id, path = line.split(b' ', maxsplit=1)
+        ids.append(int(id))
+        paths.append(path)
+        pool_size += len(path)
+        offsets.append(pool_size)
+
+    order = sorted(range(len(paths)), key=paths.__getitem__)
+    ranks = array('I', bytes(4*len(paths)))
+    for rank, pos in enumerate(order):
+        ranks[pos] = rank
+
+    header = HEADER.pack(MAGIC, len(ids), pool_size, stamp[0], stamp[1])
+    return b''.join((header, ids.tobytes(), offsets.tobytes(), ranks.tobytes(), b''.join(paths)))
+
+def db_stamp(data_dir):
+    st = os.stat(os.path.join(data_dir, 'versions.db'))
+    return st.st_mtime_ns, st.st_size
+
+def manifest_file(data_dir, version):
+    subdir = hashlib.sha1(os.path.abspath(data_dir).encode()).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, subdir, parse.quote(version, safe='') + '.manifest')
+
+def load(filename, stamp):
+    try:
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_uid != os.getuid():
+                logger.warning('ignoring manifest %s owned by another user', filename)
+                return None
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        m = Manifest(buf)
+    except (ValueError, struct.error):
+        buf.close()
+        return None
+    if m.stamp != stamp:
+        m.close()
+        return None
+    return m
+
+def write(filename, content):
+    # makedirs only applies the mode to the last directory
+    os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+    os.makedirs(os.path.dirname(filename), mode=0o700, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+# Open manifests, least recently used first
+opened = OrderedDict()
+opened_lock = threading.Lock()
+
+def get_manifest(db, data_dir, version):
+    '''Returns the Manifest of a version, or None if the version is not indexed.
+        The manifest is (re)built when versions.db has changed since it was written.'''
+    stamp = db_stamp(data_dir)
+    key = (data_dir, version)
+    with opened_lock:
+        m = opened.get(key)
+        if m is not None:
+            if m.stamp == stamp:
+                opened.move_to_end(key)
+                return m
+            del opened[key]
+
+    filename = manifest_file(data_dir, version)
+    m = load(filename, stamp)
+    if m is None:
+        pathlist = db.vers.get(version)
+        if pathlist is None:
+            return None
+        content = build(pathlist.pack(), stamp)
+        try:
+            write(filename, content)
+            m = load(filename, stamp)
+        except OSError as e:
+            logger.warning('cannot write manifest %s: %s', filename, e)
+        if m is None:
+            # Read-only cache directory: keep the manifest in memory
+            m = Manifest(content)
+
+    with opened_lock:
+        opened[key] = m
+        opened.move_to_end(key)
+        while len(opened) > MAX_OPEN:
+            # Do not close evicted manifests: another thread may still use them,
+            # the memory map is released when they are garbage collected
+            opened.popitem(last=False)
+    return m
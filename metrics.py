@@ -0,0 +1,172 @@
+#  Process-wide metrics: counters and latency histograms.
+#
+#  Enabled with LXR_METRICS=1. When disabled, count() and observe() return
+#  immediately and tool calls are not timed, only the cache statistics,
+#  which the caches always keep, are reported.
+#
+#  Names are dotted strings:
+#    tool.<name>            latency histogram of each MCP tool
+#    tool_bytes.<name>      bytes returned by each MCP tool
+#    subprocess.<command>   processes spawned (git subcommands, script.sh)
+#    bdb.<get|exists>.<db>  Berkeley DB lookups
+#    json.encode            time spent encoding responses
+#
+#  With LXR_METRICS_FILE set, a snapshot is also written to that file every
+#  LXR_METRICS_INTERVAL seconds.
+
+import atexit
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import cache
+
+logger = logging.getLogger(__name__)
+
+enabled = os.environ.get('LXR_METRICS', '0') not in ('', '0')
+DUMP_FILE = os.environ.get('LXR_METRICS_FILE')
+DUMP_INTERVAL = float(os.environ.get('LXR_METRICS_INTERVAL', '60'))
+
+# Upper bounds of the histogram buckets, in seconds, the last bucket is unbounded
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60)
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    # Upper bound of the bucket containing the p quantile
+    def quantile(self, p):
+        rank = p * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+        return None
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': {('+Inf' if i == len(BUCKETS) else str(BUCKETS[i])): n
+                        for i, n in enumerate(self.buckets) if n},
+        }
+
+lock = threading.Lock()
+counters = {}
+histograms = {}
+started = time.time()
+
+def count(name, n=1):
+    if not enabled:
+        return
+    with lock:
+        counters[name] = counters.get(name, 0) + n
+
+def observe(name, seconds):
+    if not enabled:
+        return
+    with lock:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+def observe_tool(name, seconds, result):
+    '''Records a call of the MCP tool `name` which returned `result`.'''
+    if not enabled:
+        return
+    observe('tool.' + name, seconds)
+    if isinstance(result, str):
+        # Responses are mostly ASCII, the exact UTF-8 size is not worth encoding them again
+        count('tool_bytes.' + name, len(result))
+
+def subprocess_name(args):
+    '''Counter name of a spawned command line: the git subcommand, or the
+        script.sh command.'''
+    program = os.path.basename(args[0])
+    i = 1
+    if program == 'git':
+        # Skip the global options, -C takes an argument
+        while i < len(args) and args[i].startswith('-'):
+            i += 2 if args[i] == '-C' else 1
+    if i < len(args):
+        return f'subprocess.{program} {args[i]}'
+    return 'subprocess.' + program
+
+def count_subprocess(args):
+    if enabled:
+        count(subprocess_name(args))
+
+# Hooks adding entries to the snapshot, for example the profiler summary
+sections = {}
+
+def snapshot():
+    '''Returns all the metrics as a json-serializable dict.'''
+    with lock:
+        result = {
+            'enabled': enabled,
+            'uptime': time.time() - started,
+            'counters': dict(sorted(counters.items())),
+            'histograms': {name: h.stats() for name, h in sorted(histograms.items())},
+        }
+    result['caches'] = {name: c.stats() for name, c in sorted(cache.caches.items())}
+    for name, fn in sections.items():
+        result[name] = fn()
+    return result
+
+def dump(filename):
+    '''Writes a snapshot to filename, atomically.'''
+    directory = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot(), f, indent=4)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+dump_thread = None
+
+def start_dump(filename=DUMP_FILE, interval=DUMP_INTERVAL):
+    '''Writes a snapshot to filename every interval seconds, from a daemon
+        thread, and when the process exits. Does nothing if filename is not set.'''
+    global dump_thread
+    if not filename or dump_thread is not None:
+        return
+
+    def safe_dump():
+        try:
+            dump(filename)
+        except Exception as e:
+            logger.warning('cannot write metrics to %s: %s', filename, e)
+
+    def run():
+        while True:
+            time.sleep(interval)
+            safe_dump()
+
+    atexit.register(safe_dump)
+    dump_thread = threading.Thread(target=run, name='lxr-metrics', daemon=True)
+    dump_thread.start()
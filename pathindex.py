@@ -0,0 +1,108 @@
+#  Per-version index of every path of a git tree.
+#
+#  The index maps each directory to the sorted tuple of its entries, so that
+#  existence checks and non-recursive listings are a dict lookup plus a
+#  binary search. It is built with a single `git ls-tree -r -t` and keyed by
+#  the SHA of the root tree: tags sharing a tree share the index, and since
+#  tree objects are immutable the index never needs invalidation. Indexes
+#  are kept in an LRU cache bounded by LXR_PATH_INDEX_MB.
+
+import bisect
+import os
+import subprocess
+import threading
+
+import cache
+import metrics
+
+MODE_TREE = 0o040000
+
+class PathIndex:
+    '''Directories of a tree, each mapped to a sorted tuple of
+        (name, mode, type, sha) entries. Paths have no leading or
+        trailing slash, the root directory is "".'''
+    def __init__(self, sha, dirs, nbytes):
+        self.sha = sha
+        self.dirs = dirs
+        self.nbytes = nbytes
+
+    # Returns (mode, type, sha) of a path, or None if it does not exist
+    def entry(self, path):
+        if not path:
+            return MODE_TREE, 'tree', self.sha
+        parent, _, name = path.rpartition('/')
+        entries = self.dirs.get(parent)
+        if entries is None:
+            return None
+        i = bisect.bisect_left(entries, (name,))
+        if i == len(entries) or entries[i][0] != name:
+            return None
+        return entries[i][1:]
+
+    def is_dir(self, path):
+        return path in self.dirs
+
+    def is_file(self, path):
+        entry = self.entry(path)
+        return entry is not None and entry[1] == 'blob'
+
+    def exists(self, path):
+        return path in self.dirs or self.entry(path) is not None
+
+    # Entries of a directory sorted by name, or None if it does not exist
+    def listdir(self, path):
+        return self.dirs.get(path)
+
+def build(repo_dir, sha):
+    '''Builds the PathIndex of the tree `sha`, or returns None if it is not a tree.'''
+    args = ['git', '-C', repo_dir, 'ls-tree', '-r', '-t', '-z', '--full-tree', sha]
+    metrics.count_subprocess(args)
+    res = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if res.returncode != 0:
+        return None
+
+    dirs = {'': []}
+    nbytes = 0
+    for line in res.stdout.split(b'\0'):
+        if not line:
+            continue
+        info, _, path = line.partition(b'\t')
+        mode, type, entry_sha = info.decode().split(' ')
+        path = path.decode('utf-8', 'surrogateescape')
+        parent, _, name = path.rpartition('/')
+        # ls-tree -t lists a tree before its entries
+        dirs[parent].append((name, int(mode, 8), type, entry_sha))
+        if type == 'tree':
+            dirs[path] = []
+        nbytes += 200 + 2 * len(path)
+
+    for path, entries in dirs.items():
+        entries.sort()
+        dirs[path] = tuple(entries)
+    return PathIndex(sha, dirs, nbytes)
+
+indexes = cache.LRUCache('pathindex', int(os.environ.get('LXR_PATH_INDEX_MB', '128')) * 1024 * 1024,
+                         sizeof=lambda index: index.nbytes)
+
+# Indexes being built, so that concurrent callers wait for a single build
+building = {}
+building_lock = threading.Lock()
+
+def get_index(repo_dir, sha):
+    '''Returns the PathIndex of the tree `sha` of a repository, or None if it is not a tree.'''
+    key = (repo_dir, sha)
+    index = indexes.get(key)
+    if index is not None:
+        return index
+
+    with building_lock:
+        lock = building.setdefault(key, threading.Lock())
+    with lock:
+        index = indexes.get(key)
+        if index is None:
+            index = build(repo_dir, sha)
+            if index is not None:
+                indexes.put(key, index)
+    with building_lock:
+        building.pop(key, None)
+    return index
@@ -0,0 +1,168 @@
+#  On-demand profiling of tool calls with cProfile and tracemalloc.
+#
+#  Two triggers, set with LXR_PROFILE_EVERY / LXR_PROFILE_SLOW_MS or at
+#  runtime with configure():
+#    every   : profile every Nth call of each tool
+#    slow_ms : keep the profile of any call slower than this. Since the
+#              duration is only known at the end, every call is profiled
+#              while it is set, which slows all calls down.
+#
+#  Each kept profile is written to LXR_PROFILE_DIR as <stamp>-<tool>.prof,
+#  loadable with pstats or snakeviz, and <stamp>-<tool>.json with the
+#  arguments, duration, top functions and top allocations. The summaries of
+#  the latest profiles are part of the metrics.
+#
+#  cProfile and tracemalloc are process-wide: a single call is profiled at
+#  a time, and work done concurrently by other threads shows up in it.
+
+import cProfile
+import json
+import logging
+import os
+import pstats
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.environ.get('LXR_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'elixir-mcp-profiles'))
+
+# Number of functions and allocation sites in the summaries
+TOP = 15
+
+# Number of profile summaries kept for the metrics
+HISTORY = 20
+
+every = int(os.environ.get('LXR_PROFILE_EVERY', '0'))
+slow_ms = float(os.environ.get('LXR_PROFILE_SLOW_MS', '0'))
+
+lock = threading.Lock()
+# Held while a call is profiled
+active = threading.Lock()
+calls = {}
+recent = deque(maxlen=HISTORY)
+
+def enabled():
+    return every > 0 or slow_ms > 0
+
+def configure(new_every=None, new_slow_ms=None):
+    '''Changes the triggers, 0 disables one. Returns the current settings.'''
+    global every, slow_ms
+    with lock:
+        if new_every is not None:
+            every = max(0, new_every)
+        if new_slow_ms is not None:
+            slow_ms = max(0.0, new_slow_ms)
+        return {'every': every, 'slow_ms': slow_ms, 'dir': PROFILE_DIR}
+
+def sampled(name):
+    # Whether this call of the tool is one of every Nth calls
+    if every <= 0:
+        return False
+    with lock:
+        n = calls[name] = calls.get(name, 0) + 1
+    return n % every == 0
+
+def top_functions(profile):
+    stats = pstats.Stats(profile)
+    rows = []
+    for (filename, line, function), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            'function': f'{os.path.basename(filename)}:{line}({function})',
+            'calls': ncalls,
+            'tottime': tottime,
+            'cumtime': cumtime,
+        })
+    rows.sort(key=lambda row: row['tottime'], reverse=True)
+    return rows[:TOP]
+
+def top_allocations(snapshot):
+    return [{
+        'location': f'{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}',
+        'bytes': stat.size,
+        'count': stat.count,
+    } for stat in snapshot.statistics('lineno')[:TOP]]
+
+def write(stamp, name, profile, summary):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, f'{stamp}-{re.sub(r"[^A-Za-z0-9_.-]", "_", name)}')
+    profile.dump_stats(base + '.prof')
+    with open(base + '.json', 'w') as f:
+        json.dump(summary, f, indent=4, ensure_ascii=False)
+    return base + '.prof'
+
+def call(name, fn, /, *args, **kwargs):
+    '''Calls fn(*args, **kwargs), profiling it if one of the triggers applies.'''
+    sample = sampled(name)
+    if not (sample or slow_ms > 0) or not active.acquire(blocking=False):
+        return fn(*args, **kwargs)
+
+    try:
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot() if sample or elapsed * 1000 >= slow_ms else None
+            if not tracing:
+                tracemalloc.stop()
+            if snapshot is not None:
+                keep(name, args, kwargs, profile, snapshot, elapsed, peak,
+                     'sampled' if sample else 'slow')
+    finally:
+        active.release()
+
+def keep(name, args, kwargs, profile, snapshot, elapsed, peak, reason):
+    stamp = time.strftime('%Y%m%d-%H%M%S') + f'-{time.time_ns() % 10**9:09d}'
+    summary = {
+        'tool': name,
+        'args': [repr(a)[:200] for a in args],
+        'kwargs': {k: repr(v)[:200] for k, v in kwargs.items()},
+        'reason': reason,
+        'elapsed': elapsed,
+        'peak_memory': peak,
+        'top_functions': top_functions(profile),
+        'top_allocations': top_allocations(snapshot),
+    }
+    try:
+        summary['file'] = write(stamp, name, profile, summary)
+    except OSError as e:
+        logger.warning('cannot write profile of %s to %s: %s', name, PROFILE_DIR, e)
+    with lock:
+        recent.append(summary)
+    metrics.count('profiles.' + reason)
+
+def summary():
+    '''Summaries of the latest profiles, for the metrics: the 5 functions
+        with the highest own time of each.'''
+    with lock:
+        profiles = list(recent)
+    return {
+        'settings': {'every': every, 'slow_ms': slow_ms, 'dir': PROFILE_DIR},
+        'recent': [{
+            'tool': p['tool'],
+            'args': p['args'],
+            'kwargs': p['kwargs'],
+            'reason': p['reason'],
+            'elapsed': p['elapsed'],
+            'peak_memory': p['peak_memory'],
+            'file': p.get('file'),
+            'top_functions': p['top_functions'][:5],
+        } for p in profiles],
+    }
+
+metrics.sections['profiles'] = summary
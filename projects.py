@@ -0,0 +1,111 @@
+import os
+import threading
+
+from gitstore import GitStore
+
+# 工具没有指定project时使用的项目
+DEFAULT_PROJECT = os.getenv("LXR_DEFAULT_PROJECT", "linux")
+
+
+class Project:
+    """一个项目: 索引数据目录和git仓库. GitStore和Query在第一次使用时创建,之后在进程内复用
+
+    所有项目的缓存(标识符查询结果,路径索引,tree,commit等)都是进程内共享的,
+    共用同一份内存上限
+    """
+    def __init__(self, base_dir, name, data_dir, repo_dir):
+        self.base_dir = base_dir
+        self.name = name
+        self.data_dir = data_dir
+        self.repo_dir = repo_dir
+        self.lock = threading.Lock()
+        self._store = None
+
+    def get_store(self) -> GitStore:
+        if self._store is not None:
+            return self._store
+        with self.lock:
+            if self._store is None:
+                self._store = GitStore(self.repo_dir)
+            return self._store
+
+    def get_query(self) -> "query.Query":
+        # query会导入berkeleydb,在第一次查询标识符时才导入
+        import query
+        q = None
+        if self.base_dir and self.data_dir:
+            q = query.get_shared_query(self.base_dir, self.name, self.repo_dir)
+        if q is None:
+            raise RuntimeError(f"项目{self.name}的索引数据不存在")
+        return q
+
+    def info(self) -> dict:
+        return {
+            "name": self.name,
+            "indexed": self.data_dir is not None,
+            "default": self.name == DEFAULT_PROJECT,
+        }
+
+
+class Registry:
+    """base_dir下每一个包含repo目录的子目录是一个项目,有data目录时可以查询标识符.
+
+    repo_dirs可以为项目指定不在base_dir中的git仓库,例如REPO_DIR指定的默认项目的仓库.
+    请求了不存在的项目时,如果base_dir有变化会重新扫描
+    """
+    def __init__(self, base_dir, repo_dirs=None):
+        self.base_dir = base_dir
+        self.repo_dirs = repo_dirs or {}
+        self.lock = threading.Lock()
+        self.projects = None
+        self.stamp = None
+
+    def _stamp(self):
+        try:
+            return os.stat(self.base_dir).st_mtime_ns if self.base_dir else None
+        except OSError:
+            return None
+
+    def _scan(self) -> dict:
+        found = {}
+        names = set(self.repo_dirs)
+        if self.base_dir and os.path.isdir(self.base_dir):
+            names.update(os.listdir(self.base_dir))
+        for name in sorted(names):
+            data_dir = os.path.join(self.base_dir, name, "data") if self.base_dir else None
+            if data_dir is not None and not os.path.isdir(data_dir):
+                data_dir = None
+            repo_dir = self.repo_dirs.get(name)
+            if repo_dir is None and self.base_dir:
+                repo_dir = os.path.join(self.base_dir, name, "repo")
+            if repo_dir is None or not os.path.isdir(repo_dir):
+                continue
+            # 已经打开的项目保持不变,它们的句柄继续复用
+            old = (self.projects or {}).get(name)
+            if old is not None and (old.data_dir, old.repo_dir) == (data_dir, repo_dir):
+                found[name] = old
+            else:
+                found[name] = Project(self.base_dir, name, data_dir, repo_dir)
+        return found
+
+    def _refresh(self):
+        with self.lock:
+            stamp = self._stamp()
+            if self.projects is None or stamp != self.stamp:
+                self.projects = self._scan()
+                self.stamp = stamp
+            return self.projects
+
+    def list(self) -> list:
+        return list(self._refresh().values())
+
+    def get(self, name: str = "") -> Project:
+        """返回名为name的项目,name为空时返回默认项目,不存在时抛出异常"""
+        name = name or DEFAULT_PROJECT
+        projects = self.projects
+        if projects is None or name not in projects:
+            projects = self._refresh()
+        project = projects.get(name)
+        if project is None:
+            raise RuntimeError(f"项目{name}不存在")
+        return project
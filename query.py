@@ -24,19 +24,28 @@
 
 from lib import *
 from data import *
-import lib, data
+import lib, data, gitbatch, manifest, pathindex, join, cache, refs, tags, tokenizer
 
 import os
+import atexit
+import heapq
+import logging
+import threading
 from collections import OrderedDict
+from dataclasses import dataclass
 from urllib import parse
 
 from io import BytesIO
 
-class SymbolInstance(object):
-    def __init__(self, path, line, type=None):
-        self.path = path
-        self.line = line
-        self.type = type
+# One definition, reference or documentation comment of an identifier.
+# Queries can return tens of thousands of them: instances have no __dict__,
+# and build_resp serializes them through to_dict() one at a time, so the
+# dicts are never all alive at once.
+@dataclass(slots=True, repr=False)
+class SymbolInstance:
+    path: str
+    line: object
+    type: str = None
 
     def __repr__(self):
         type_repr = ""
@@ -55,25 +64,78 @@ class SymbolInstance(object):
     def __str__(self):
         return self.__repr__()
 
+logger = logging.getLogger(__name__)
+
+# Approximate memory used by the result of an ident query
+def ident_result_size(result):
+    symbols, totals = result
+    return 64 + sum(80 + len(s.path) + len(str(s.line)) for section in symbols for s in section)
+
+# Results of ident queries, shared by all Query instances and bounded by
+# LXR_IDENT_CACHE_MB. Keys contain the state of variables.db, which is
+# updated each time the index changes, so stale results are never returned.
+ident_cache = cache.LRUCache('ident', int(os.environ.get('LXR_IDENT_CACHE_MB', '256')) * 1024 * 1024,
+                             sizeof=ident_result_size)
+
+# Optionally keep the ident cache across restarts
+ident_cache_file = os.environ.get('LXR_IDENT_CACHE_FILE')
+if ident_cache_file:
+    ident_cache.load(ident_cache_file)
+
+    @atexit.register
+    def save_ident_cache():
+        try:
+            ident_cache.save(ident_cache_file)
+        except OSError as e:
+            logger.warning('cannot save the ident cache to %s: %s', ident_cache_file, e)
+
 # Returns a Query class instance or None if project data directory does not exist
 # basedir: absolute path to parent directory of all project data directories, ex. "/srv/elixir-data/"
 # project: name of the project, directory in basedir, ex. "linux"
-def get_query(basedir, project):
+# shared: open the databases with DB_THREAD so that the instance can be used from several threads
+# repodir: git repository of the project, if it is not in basedir
+def get_query(basedir, project, shared=False, repodir=None):
     datadir = basedir + '/' + project + '/data'
-    repodir = basedir + '/' + project + '/repo'
+    repodir = repodir or basedir + '/' + project + '/repo'
 
     if not os.path.exists(datadir) or not os.path.exists(repodir):
         return None
 
-    return Query(datadir, repodir)
+    return Query(datadir, repodir, shared=shared)
+
+# Process-wide registry of long-lived Query instances, one per project.
+# The databases are opened once and closed when the process exits.
+queries = {}
+queries_lock = threading.Lock()
+
+# Same as get_query, but returns a shared instance which must not be closed by the caller
+def get_shared_query(basedir, project, repodir=None):
+    key = (os.path.abspath(basedir), project, repodir)
+    with queries_lock:
+        q = queries.get(key)
+        if q is None:
+            q = get_query(basedir, project, shared=True, repodir=repodir)
+            if q is not None:
+                queries[key] = q
+        return q
+
+@atexit.register
+def close_shared_queries():
+    with queries_lock:
+        for q in queries.values():
+            q.close()
+        queries.clear()
 
 class Query:
-    def __init__(self, data_dir, repo_dir):
+    def __init__(self, data_dir, repo_dir, shared=False):
         self.repo_dir = repo_dir
         self.data_dir = data_dir
+        # Long-lived git cat-file processes for blob, type and tree lookups
+        self.git = gitbatch.get_pool(repo_dir)
+        self.refs = refs.get_resolver(repo_dir)
         self.dts_comp_support = int(self.script('dts-comp'))
-        self.db = data.DB(data_dir, readonly=True, dtscomp=self.dts_comp_support)
-        self.file_cache = {}
+        self.db = data.DB(data_dir, readonly=True, dtscomp=self.dts_comp_support, shared=shared)
+        self.indexed_tags = None
 
     def script(self, *args):
         return script(*args, env=self.getEnv())
@@ -98,20 +160,10 @@ class Query:
             # topmenu submenu tag
             # Example: v3 v3.1 v3.1-rc10
             versions = OrderedDict()
+            indexed = self.get_indexed_tags()
 
-            for line in self.scriptLines('list-tags', '-h'):
-                taginfo = decode(line).split(' ')
-                num = len(taginfo)
-                topmenu, submenu = 'FIXME', 'FIXME'
-
-                if num == 1:
-                    tag, = taginfo
-                elif num == 2:
-                    submenu,tag = taginfo
-                elif num ==3:
-                    topmenu,submenu,tag = taginfo
-
-                if self.db.vers.exists(tag):
+            for topmenu, submenu, tag in self.get_tags().menu:
+                if tag in indexed:
                     if topmenu not in versions:
                         versions[topmenu] = OrderedDict()
                     if submenu not in versions[topmenu]:
@@ -124,14 +176,15 @@ class Query:
 
             # Returns the latest tag that is included in the database.
             # This excludes release candidates.
-            sorted_tags = self.scriptLines('get-latest-tags')
+            sorted_tags = self.get_tags().latest
+            indexed = self.get_indexed_tags()
 
             for tag in sorted_tags:
-                if self.db.vers.exists(tag):
-                    return tag.decode()
+                if tag in indexed:
+                    return tag
 
             # return the oldest tag, even if it does not exist in the database
-            return sorted_tags[-1].decode()
+            return sorted_tags[-1]
 
         elif cmd == 'type':
 
@@ -144,25 +197,14 @@ class Query:
 
             version = args[0]
             path = args[1]
-            return decode(self.script('get-type', version, path)).strip()
+            return self.git.get_type(self.object_ref(version, path))
 
         elif cmd == 'exist':
             version = args[0]
             path = args[1]
 
-            if version not in self.file_cache:
-                version_cache = set()
-                last_dir = None
-                for _, path in self.db.vers.get(version).iter():
-                    dirname, filename = os.path.split(path)
-                    if dirname != last_dir:
-                        last_dir = dirname
-                        version_cache.add(dirname)
-                    version_cache.add(path)
-
-                self.file_cache[version] = version_cache
-
-            return path.strip('/') in self.file_cache[version]
+            index = self.get_path_index(version)
+            return index is not None and index.exists(path.strip('/'))
 
         elif cmd == 'dir':
 
@@ -171,8 +213,11 @@ class Query:
 
             version = args[0]
             path = args[1]
-            entries_str =  decode(self.script('get-dir', version, path))
-            return entries_str.split("\n")[:-1]
+            index = self.get_path_index(version)
+            entries = index.listdir(path.strip('/')) if index is not None else None
+            if entries is None:
+                return []
+            return self.git.format_dir([(f'{mode:06o}', type, sha, name) for name, mode, type, sha in entries])
 
         elif cmd == 'file':
 
@@ -188,27 +233,34 @@ class Query:
 
             if family != None:
                 assert family in lib.CACHED_DEFINITIONS_FAMILIES, f"family {family} must have its definitions cached"
-                print(f'family: {family}')
+                content = self.git.get_blob(self.object_ref(version, path)) or b''
+                tokens = tokenizer.tokenize(content, family)
                 buffer = BytesIO()
-                tokens = self.scriptLines('tokenize-file', version, path, family)
                 even = True
-                print(f'tokens: {tokens}')
 
                 prefix = b''
                 if family == 'K':
                     prefix = b'CONFIG_'
-                
+
+                # Identifiers are repeated a lot in a file,
+                # look each distinct one up only once
+                defs_cache = self.db.defs_cache[family]
+                defined = {}
+
                 for tok in tokens:
                     even = not even
-                    tok2 = prefix + tok
-                    if even and self.db.defs_cache[family].exists(tok2):
-                        tok = b'\033[31m' + tok2 + b'\033[0m'
-                    else:
-                        tok = lib.unescape(tok)
-                    buffer.write(tok)
+                    if even:
+                        tok2 = prefix + tok
+                        hit = defined.get(tok2)
+                        if hit is None:
+                            hit = defined[tok2] = defs_cache.exists(tok2)
+                        if hit:
+                            buffer.write(b'\033[31m' + tok2 + b'\033[0m')
+                            continue
+                    buffer.write(lib.unescape(tok))
                 return decode(buffer.getvalue())
             else:
-                return decode(self.script('get-file', version, path))
+                return self.get_file_raw(version, path)
 
         elif cmd == 'family':
             # Get the family of a given file
@@ -268,152 +320,379 @@ class Query:
             ident = args[1]
             family = args[2]
 
-            # DT bindings compatible strings are handled differently
-            if family == 'B':
-                return self.get_idents_comps(version, ident)
-            else:
-                return self.get_idents_defs(version, ident, family)
+            return self.get_idents(version, ident, family)[0]
 
         else:
             return 'Unknown subcommand: ' + cmd + '\n'
 
+    # State of the index, changes each time update.py modifies it
+    def db_stamp(self):
+        st = os.stat(os.path.join(self.data_dir, 'variables.db'))
+        return st.st_mtime_ns, st.st_size
+
+    # Page of identifier search results found in ident_cache, or None.
+    # base is the cache key of the identifier without the page.
+    def get_cached_idents(self, base, offsets, limit):
+        result = ident_cache.get(base + (offsets, limit))
+        if result is not None:
+            return result
+
+        # A page can be cut from the complete result if it is already known
+        if limit is not None or offsets != (0, 0, 0):
+            complete = ident_cache.get(base + ((0, 0, 0), None))
+            if complete is not None:
+                symbols, totals = complete
+                end = lambda o: o + limit if limit is not None else None
+                return tuple(s[o:end(o)] for s, o in zip(symbols, offsets)), totals
+        return None
+
+    # Identifier search results, served from ident_cache when possible.
+    # Returns the three symbol lists restricted to [offsets[i], offsets[i]+limit)
+    # in each section, and the total number of symbols of each section.
+    def get_idents(self, version, ident, family, offsets=(0, 0, 0), limit=None):
+        base = (os.path.abspath(self.data_dir), self.db_stamp(), version, ident, family)
+        offsets = tuple(offsets)
+        result = self.get_cached_idents(base, offsets, limit)
+        if result is not None:
+            return result
+
+        # DT bindings compatible strings are handled differently
+        if family == 'B':
+            result = self.get_idents_comps_page(version, ident, offsets, limit)
+        else:
+            result = self.get_idents_defs_page(version, ident, family, offsets, limit)
+        ident_cache.put(base + (offsets, limit), result)
+        return result
+
+    # Identifier search results for several identifiers of the same version,
+    # in the same order as idents, a list of (ident, family) pairs.
+    # Identifiers missing from ident_cache are looked up with a single
+    # pass over the manifest of the version.
+    def get_idents_many(self, version, idents, offsets=(0, 0, 0), limit=None):
+        data_dir = os.path.abspath(self.data_dir)
+        stamp = self.db_stamp()
+        offsets = tuple(offsets)
+        results = [None] * len(idents)
+        missing = []
+        for i, (ident, family) in enumerate(idents):
+            results[i] = self.get_cached_idents((data_dir, stamp, version, ident, family), offsets, limit)
+            if results[i] is None:
+                missing.append(i)
+
+        defs = []
+        for i in missing:
+            ident, family = idents[i]
+            if family == 'B':
+                results[i] = self.get_idents_comps_page(version, ident, offsets, limit)
+            else:
+                defs.append(i)
+
+        if defs:
+            for i, result in zip(defs, self.get_idents_defs_many(version, [idents[i] for i in defs], offsets, limit)):
+                results[i] = result
+
+        for i in missing:
+            ident, family = idents[i]
+            ident_cache.put((data_dir, stamp, version, ident, family, offsets, limit), results[i])
+        return results
+
+    # Returns the path index of a version, or None if the version does not exist
+    def get_path_index(self, version):
+        res = self.refs.resolve(version)
+        if res is None:
+            return None
+        return pathindex.get_index(self.repo_dir, res.tree)
+
+    # Object name of a path in a version, using the resolved root tree
+    # so that git does not resolve the version again
+    def object_ref(self, version, path):
+        res = self.refs.resolve(version)
+        return gitbatch.object_ref(res.tree if res is not None else version, path)
+
+    # Returns the file manifest of a version, or None if it is not indexed
+    def get_manifest(self, version):
+        return manifest.get_manifest(self.db, self.data_dir, version)
+
     def get_file_raw(self, version, path):
-        return decode(self.script('get-file', version, path))
+        return decode(self.git.get_blob(self.object_ref(version, path)) or b'')
 
     def get_idents_comps(self, version, ident):
+        return self.get_idents_comps_page(version, ident)[0]
+
+    def get_idents_comps_page(self, version, ident, offsets=(0, 0, 0), limit=None):
 
         # DT bindings compatible strings are handled differently
         # They are defined in C files
         # Used in DT files
         # Documented in documentation files
-        symbol_c = []
-        symbol_dts = []
-        symbol_docs = []
+        empty = ([], [], []), (0, 0, 0)
 
         # DT compatible strings are quoted in the database
         ident = parse.quote(ident)
 
         if not self.dts_comp_support or not self.db.comps.exists(ident):
-            return symbol_c, symbol_dts, symbol_docs
+            return empty
 
-        files_this_version = self.db.vers.get(version).iter()
-        comps = self.db.comps.get(ident).iter(dummy=True)
+        files_this_version = self.get_manifest(version)
+        if files_this_version is None:
+            return empty
+
+        comps = self.db.comps.get(ident).entries()
 
         if self.db.comps_docs.exists(ident):
-            comps_docs = self.db.comps_docs.get(ident).iter(dummy=True)
+            comps_docs = self.db.comps_docs.get(ident).entries()
         else:
-            comps_docs = data.RefList().iter(dummy=True)
+            comps_docs = []
 
-        comps_idx, comps_lines, comps_family = next(comps)
-        comps_docs_idx, comps_docs_lines, comps_docs_family = next(comps_docs)
         compsCBuf = [] # C/CPP/ASM files
         compsDBuf = [] # DT files
         compsBBuf = [] # DT bindings docs files
 
-        for file_idx, file_path in files_this_version:
-            while comps_idx < file_idx:
-                comps_idx, comps_lines, comps_family = next(comps)
-
-            while comps_docs_idx < file_idx:
-                comps_docs_idx, comps_docs_lines, comps_docs_family = next(comps_docs)
-
-            if comps_idx == file_idx:
-                if comps_family == 'C':
-                    compsCBuf.append((file_path, comps_lines))
-                elif comps_family == 'D':
-                    compsDBuf.append((file_path, comps_lines))
-
-            if comps_docs_idx == file_idx:
-                compsBBuf.append((file_path, comps_docs_lines))
-
-        for path, cline in sorted(compsCBuf):
-            symbol_c.append(SymbolInstance(path, cline, 'compatible'))
-
-        for path, dlines in sorted(compsDBuf):
-            symbol_dts.append(SymbolInstance(path, dlines))
-
-        for path, blines in sorted(compsBBuf):
-            symbol_docs.append(SymbolInstance(path, blines))
-
-        return symbol_c, symbol_dts, symbol_docs
+        # Match the blob ids against the manifest of the version. Matches are
+        # sorted by the path rank stored in the manifest, so that only the
+        # paths of the requested window are decoded.
+        rank = files_this_version.rank
+        sel, pos = join.match(files_this_version, [e[0] for e in comps])
+        for i, p in zip(sel, pos):
+            _, comps_lines, comps_family = comps[i]
+            if comps_family == b'C':
+                compsCBuf.append((rank(p), comps_lines, p))
+            elif comps_family == b'D':
+                compsDBuf.append((rank(p), comps_lines, p))
+
+        sel, pos = join.match(files_this_version, [e[0] for e in comps_docs])
+        for i, p in zip(sel, pos):
+            compsBBuf.append((rank(p), comps_docs[i][1], p))
+
+        path = files_this_version.path
+        symbol_c = [SymbolInstance(path(p), cline.decode(), 'compatible')
+                    for _, cline, p in window(compsCBuf, offsets[0], limit)]
+        symbol_dts = [SymbolInstance(path(p), dlines.decode())
+                      for _, dlines, p in window(compsDBuf, offsets[1], limit)]
+        symbol_docs = [SymbolInstance(path(p), blines.decode())
+                       for _, blines, p in window(compsBBuf, offsets[2], limit)]
+
+        return (symbol_c, symbol_dts, symbol_docs), (len(compsCBuf), len(compsDBuf), len(compsBBuf))
 
     def get_idents_defs(self, version, ident, family):
+        return self.get_idents_defs_page(version, ident, family)[0]
 
-        symbol_definitions = []
-        symbol_references = []
-        symbol_doccomments = []
+    def get_idents_defs_page(self, version, ident, family, offsets=(0, 0, 0), limit=None):
+        return self.get_idents_defs_many(version, [(ident, family)], offsets, limit)[0]
 
+    # Returns the raw def, ref and doc entries of an identifier which are
+    # compatible with the requested family, or None if it is not defined
+    def get_ident_entries(self, ident, family):
         if not self.db.defs.exists(ident):
-            return symbol_definitions, symbol_references, symbol_doccomments
-
-        if not self.db.vers.exists(version):
-            return symbol_definitions, symbol_references, symbol_doccomments
+            return None
 
-        files_this_version = self.db.vers.get(version).iter()
         this_ident = self.db.defs.get(ident)
-        defs_this_ident = this_ident.iter(dummy=True)
+        defs_this_ident = this_ident.entries()
         macros_this_ident = this_ident.get_macros()
         # FIXME: see why we can have a discrepancy between defs_this_ident and refs
         if self.db.refs.exists(ident):
-            refs = self.db.refs.get(ident).iter(dummy=True)
+            refs = self.db.refs.get(ident).entries()
         else:
-            refs = data.RefList().iter(dummy=True)
+            refs = []
 
         if self.db.docs.exists(ident):
-            docs = self.db.docs.get(ident).iter(dummy=True)
+            docs = self.db.docs.get(ident).entries()
         else:
-            docs = data.RefList().iter(dummy=True)
-
-        # vers, defs, refs, and docs are all populated by update.py in order of
-        # idx, and there is a one-to-one mapping between blob hashes and idx
-        # values.  Therefore, we can sequentially step through the defs, refs,
-        # and docs for each file in a version.
-
-        def_idx, def_type, def_line, def_family = next(defs_this_ident)
-        ref_idx, ref_lines, ref_family = next(refs)
-        doc_idx, doc_line, doc_family = next(docs)
-
-        dBuf = []
-        rBuf = []
-        docBuf = []
-
-        for file_idx, file_path in files_this_version:
-            # Advance defs, refs, and docs to the current file
-            while def_idx < file_idx:
-                def_idx, def_type, def_line, def_family = next(defs_this_ident)
-            while ref_idx < file_idx:
-                ref_idx, ref_lines, ref_family = next(refs)
-            while doc_idx < file_idx:
-                doc_idx, doc_line, doc_family = next(docs)
-
-            # Copy information about this identifier into dBuf, rBuf, and docBuf.
-            while def_idx == file_idx:
-                if (def_family == family or family == 'A'
-                    or lib.compatibleMacro(macros_this_ident, family)):
-                    dBuf.append((file_path, def_type, def_line))
-                def_idx, def_type, def_line, def_family = next(defs_this_ident)
-
-            if ref_idx == file_idx:
-                if lib.compatibleFamily(family, ref_family) or family == 'A':
-                    rBuf.append((file_path, ref_lines))
-
-            if doc_idx == file_idx: # TODO should this be a `while`?
-                docBuf.append((file_path, doc_line))
-
-        # Sort dBuf by path name before sorting by type in the loop
-        dBuf.sort()
-
-        for path, type, dline in sorted(dBuf, key=lambda d: d[1], reverse=True):
-            symbol_definitions.append(SymbolInstance(path, dline, type))
-
-        for path, rlines in sorted(rBuf):
-            symbol_references.append(SymbolInstance(path, rlines))
-
-        for path, docline in sorted(docBuf):
-            symbol_doccomments.append(SymbolInstance(path, docline))
-
-        return symbol_definitions, symbol_references, symbol_doccomments
-
+            docs = []
+
+        # Filter by family before the join, the compatibility checks
+        # only depend on the few distinct family strings
+        compatible_macro = lib.compatibleMacro(macros_this_ident, family) if family in lib.compatibility_list else False
+        if not (family == 'A' or compatible_macro):
+            family_bytes = family.encode()
+            defs_this_ident = [e for e in defs_this_ident if e[3] == family_bytes]
+
+        compatible = {}
+        def compatible_ref(ref_family):
+            res = compatible.get(ref_family)
+            if res is None:
+                res = compatible[ref_family] = (family == 'A'
+                    or lib.compatibleFamily(family, ref_family.decode()))
+            return res
+
+        refs = [e for e in refs if compatible_ref(e[2])]
+        return defs_this_ident, refs, docs
+
+    # Identifier search results for several identifiers of the same version.
+    # idents is a list of (ident, family) pairs, the result is a list of
+    # (symbols, totals) in the same order, see get_idents.
+    def get_idents_defs_many(self, version, idents, offsets=(0, 0, 0), limit=None):
+
+        empty = ([], [], []), (0, 0, 0)
+
+        files_this_version = self.get_manifest(version)
+        if files_this_version is None:
+            return [empty for _ in idents]
+
+        # defs, refs, and docs are keyed by blob idx, and the manifest of the
+        # version is sorted by idx. Instead of walking every file of the
+        # version, the idx of every entry of every identifier are matched
+        # against the manifest at once by the join engine. A blob can be
+        # present under several paths, in which case every path is reported.
+        # Matches are sorted by the path rank stored in the manifest, and
+        # entries and paths are only decoded for the requested window.
+
+        entries = [self.get_ident_entries(ident, family) for ident, family in idents]
+        sections = [section for e in entries if e is not None for section in e]
+
+        blob_ids = []
+        for section in sections:
+            blob_ids.extend(e[0] for e in section)
+        sel, pos = join.match(files_this_version, blob_ids)
+
+        # Matches are returned in the order of blob_ids: split them back
+        # into the sections they come from
+        rank = files_this_version.rank
+        bufs = [[] for _ in sections]
+        s = 0
+        start = 0
+        end = len(sections[0]) if sections else 0
+        for i, p in zip(sel, pos):
+            while i >= end:
+                s += 1
+                start = end
+                end += len(sections[s])
+            e = sections[s][i - start]
+            if s % 3 == 0:
+                # Definitions are sorted by type in reverse order, then by path and line
+                def_type = data.defTypeR[e[1].decode()]
+                bufs[s].append((def_type_order[def_type], rank(p), int(e[2]), p, def_type))
+            else:
+                bufs[s].append((rank(p), e[1], p))
+
+        paths = {}
+        def path_of(pos):
+            path = paths.get(pos)
+            if path is None:
+                path = paths[pos] = files_this_version.path(pos)
+            return path
+
+        results = []
+        s = 0
+        for e in entries:
+            if e is None:
+                results.append(empty)
+                continue
+            dBuf, rBuf, docBuf = bufs[s:s+3]
+            s += 3
+
+            symbol_definitions = [SymbolInstance(path_of(p), dline, type)
+                                  for _, _, dline, p, type in window(dBuf, offsets[0], limit)]
+            symbol_references = [SymbolInstance(path_of(p), rlines.decode())
+                                 for _, rlines, p in window(rBuf, offsets[1], limit)]
+            symbol_doccomments = [SymbolInstance(path_of(p), docline.decode())
+                                  for _, docline, p in window(docBuf, offsets[2], limit)]
+
+            results.append(((symbol_definitions, symbol_references, symbol_doccomments),
+                            (len(dBuf), len(rBuf), len(docBuf))))
+
+        return results
+
+    # Tags of the repository, see tags.Tags
+    def get_tags(self):
+        return tags.get_catalog(self.repo_dir).get()
+
+    # Set of the tags present in versions.db, recomputed when the tags
+    # or the index change
+    def get_indexed_tags(self):
+        all_tags = self.get_tags()
+        key = (all_tags.stamp, manifest.db_stamp(self.data_dir))
+        indexed = self.indexed_tags
+        if indexed is None or indexed[0] != key:
+            indexed = self.indexed_tags = (key, frozenset(tag for tag in all_tags.names if self.db.vers.exists(tag)))
+        return indexed[1]
+
+    # Indexed versions, oldest first
+    def indexed_versions(self):
+        indexed = self.get_indexed_tags()
+        return [tag for tag in self.get_tags().names if tag in indexed]
+
+    # Evolution of an identifier over a list of versions, oldest first.
+    # Returns a list of (version, totals, added, removed): added and removed
+    # hold the (defs, refs, docs) which appeared or disappeared since the
+    # previous version of the list, everything is added in the first one.
+    # Versions which are not indexed are skipped.
+    def get_ident_history(self, ident, family, versions):
+        entries = self.get_ident_entries(ident, family)
+        if entries is None:
+            entries = [], [], []
+        defs, refs, docs = entries
+
+        # Entries only depend on the blob: they are decoded once, and each
+        # version only contributes the (blob, path) pairs of its manifest.
+        # Consecutive versions share most of their blobs, so the deltas
+        # are computed on these pairs before building any symbol.
+        blobs = {}
+        def blob(blob_id):
+            b = blobs.get(blob_id)
+            if b is None:
+                b = blobs[blob_id] = ([], [], [])
+            return b
+
+        for e in defs:
+            blob(int(e[0]))[0].append((int(e[2]), data.defTypeR[e[1].decode()]))
+        for e in refs:
+            blob(int(e[0]))[1].append((e[1].decode(), None))
+        for e in docs:
+            blob(int(e[0]))[2].append((e[1].decode(), None))
+
+        blob_ids = sorted(blobs)
+        history = []
+        previous = set()
+        for version in versions:
+            files_this_version = self.get_manifest(version)
+            if files_this_version is None:
+                continue
+            sel, pos = join.match(files_this_version, blob_ids)
+            current = {(blob_ids[i], files_this_version.path(p)) for i, p in zip(sel, pos)}
+
+            totals = [0, 0, 0]
+            for blob_id, _ in current:
+                for i, items in enumerate(blobs[blob_id]):
+                    totals[i] += len(items)
+
+            # A file modified between the versions changes blob: only report
+            # the symbols which actually moved
+            added = items_of(blobs, current - previous)
+            removed = items_of(blobs, previous - current)
+            history.append((version, tuple(totals),
+                            tuple(symbols_of(a - r) for a, r in zip(added, removed)),
+                            tuple(symbols_of(r - a) for a, r in zip(added, removed))))
+            previous = current
+
+        return history
+
+# Definitions are listed by type in reverse alphabetical order
+def_type_order = {type: i for i, type in enumerate(sorted(data.defTypeR.values(), reverse=True))}
+
+# Returns the sorted items in [offset, offset+limit), without sorting
+# all the items when the window is small
+def window(items, offset, limit):
+    if limit is None:
+        items.sort()
+        return items[offset:]
+    end = offset + limit
+    if end < len(items) // 4:
+        return heapq.nsmallest(end, items)[offset:]
+    items.sort()
+    return items[offset:end]
+
+# Returns the (defs, refs, docs) of a set of (blob id, path) pairs,
+# as sets of (path, line, type)
+def items_of(blobs, files):
+    items = (set(), set(), set())
+    for blob_id, path in files:
+        for i, blob_items in enumerate(blobs[blob_id]):
+            items[i].update((path, line, type) for line, type in blob_items)
+    return items
+
+def symbols_of(items):
+    return [SymbolInstance(path, line, type) for path, line, type in sorted(items)]
 
 def cmd_ident(q, version, ident, family, **kwargs):
     symbol_definitions, symbol_references, symbol_doccomments = q.query("ident", version, ident, family)
@@ -0,0 +1,103 @@
+#  Shared cache of resolved revisions.
+#
+#  Every tool receives a version, tag or (abbreviated) commit id and used to
+#  have git resolve it again for each object it reads. The resolver maps a
+#  revision to its commit SHA and root tree SHA once:
+#    - hits are kept until they are evicted from the LRU. Full commit SHAs
+#      never change. Tag names are keyed with the state of the tags, so a
+#      moved or deleted tag is resolved again. Other names (HEAD, branches,
+#      expressions such as HEAD~1) are also keyed with the state of HEAD and
+#      of the other refs, which changes with every commit.
+#    - misses are kept for LXR_REF_MISS_TTL seconds, so that a tag or commit
+#      fetched later is eventually found.
+#  Both caches are shared by all the repositories of the process, their keys
+#  start with the repository directory.
+
+import os
+import re
+import subprocess
+import threading
+import time
+from collections import namedtuple
+
+import cache
+import gitbatch
+import metrics
+import tags
+
+MISS_TTL = float(os.environ.get('LXR_REF_MISS_TTL', '60'))
+
+full_sha_regex = re.compile(r'^[0-9a-f]{40}([0-9a-f]{24})?$')
+
+Resolved = namedtuple('Resolved', ['commit', 'tree'])
+
+hits = cache.LRUCache('refs', 65536)
+misses = cache.LRUCache('refs_missing', 65536)
+
+class RefResolver:
+    def __init__(self, repo_dir):
+        self.repo_dir = repo_dir
+        self.git = gitbatch.get_pool(repo_dir)
+        self.catalog = tags.get_catalog(repo_dir)
+        # HEAD is per worktree, the other refs are in the common directory
+        args = ['git', '-C', repo_dir, 'rev-parse', '--git-dir']
+        metrics.count_subprocess(args)
+        res = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.git_dir = os.path.join(repo_dir, res.stdout.decode().strip() or '.git')
+
+    # Changes when HEAD or any ref other than a tag is updated: git writes
+    # them with a rename, which changes the mtime of their directory
+    def refs_stamp(self):
+        refs_dir = os.path.join(self.catalog.git_dir, 'refs')
+        dirs = [self.git_dir, self.catalog.git_dir]
+        for root, subdirs, _ in os.walk(refs_dir):
+            if root == refs_dir and 'tags' in subdirs:
+                subdirs.remove('tags')
+            dirs.append(root)
+        stamp = []
+        for path in dirs:
+            try:
+                stamp.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def key(self, rev):
+        if full_sha_regex.match(rev):
+            return self.repo_dir, rev
+        catalog = self.catalog.get()
+        if rev in catalog.shas:
+            return self.repo_dir, rev, catalog.stamp
+        return self.repo_dir, rev, catalog.stamp, self.refs_stamp()
+
+    def resolve(self, rev):
+        '''Returns the Resolved commit and tree SHAs of a revision, or None
+            if it does not name a commit.'''
+        key = self.key(rev)
+        res = hits.get(key)
+        if res is not None:
+            return res
+        expires = misses.get(key)
+        if expires is not None and expires > time.monotonic():
+            return None
+
+        commit, tree = self.git.info_many([rev + '^{commit}', rev + '^{tree}'])
+        if commit is None or tree is None:
+            misses.put(key, time.monotonic() + MISS_TTL)
+            return None
+        res = Resolved(commit[0], tree[0])
+        hits.put(key, res)
+        misses.pop(key)
+        return res
+
+resolvers = {}
+resolvers_lock = threading.Lock()
+
+def get_resolver(repo_dir):
+    '''Returns the RefResolver shared by the whole process for a repository.'''
+    repo_dir = os.path.abspath(repo_dir)
+    with resolvers_lock:
+        resolver = resolvers.get(repo_dir)
+        if resolver is None:
+            resolver = resolvers[repo_dir] = RefResolver(repo_dir)
+        return resolver
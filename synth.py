@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+#  Synthetic Elixir project generator, for benchmarks without a full
+#  Linux index.
+#
+#  ./synth.py BASE_DIR [--files N] [--tags T] [--changes F] [--idents I]
+#      Creates BASE_DIR/linux/repo, a git repository with T tags, and
+#      BASE_DIR/linux/data, the matching Elixir databases (versions,
+#      definitions, references, doccomments, definitions-cache-*, ...).
+#
+#  Every file is a small C file defining a few functions, each preceded by
+#  a doc comment and calling other functions, plus some "hot" macros
+#  referenced from every file. Each tag modifies a fraction F of the files
+#  and adds one. Definitions and references are known by construction, so
+#  the index is written directly instead of running Elixir's update.py.
+
+import argparse
+import hashlib
+import os
+import random
+import subprocess
+import time
+
+import data
+
+PROJECT = 'linux'
+
+# Macros defined in include/hot.h and referenced from every file
+HOT_IDENTS = ['HOT_LOCK', 'HOT_UNLOCK', 'HOT_BUG_ON']
+
+def tag_name(t):
+    return f'v{1 + t // 10}.{t % 10}'
+
+def file_path(f):
+    return f'dir{f % 97}/sub{f % 13}/file{f}.c'
+
+class Blob:
+    '''Content of a file, with the definitions, references and doc
+        comments it contains: lists of (ident, type, line) and (ident, line).'''
+    def __init__(self):
+        self.lines = []
+        self.defs = []
+        self.refs = []
+        self.docs = []
+
+    def add(self, line):
+        self.lines.append(line)
+        return len(self.lines)
+
+    def content(self):
+        return ''.join(line + '\n' for line in self.lines).encode()
+
+def make_header():
+    blob = Blob()
+    blob.add('/* Synthetic header */')
+    for ident in HOT_IDENTS:
+        line = blob.add(f'#define {ident}(x) do {{ (void)(x); }} while (0)')
+        blob.defs.append((ident, 'macro', line))
+    return blob
+
+def make_file(f, rev, idents, rng):
+    '''Content of file f at revision rev: defines 3 functions, each one
+        calling 2 others and a hot macro.'''
+    blob = Blob()
+    blob.add(f'// file{f} revision {rev}')
+    blob.add('#include <hot.h>')
+    for k in range(3):
+        ident = idents[(f * 3 + k) % len(idents)]
+        blob.add('')
+        doc = blob.add(f'/** {ident} - synthetic function */')
+        blob.docs.append((ident, doc))
+        line = blob.add(f'int {ident}(int x)')
+        blob.defs.append((ident, 'function', line))
+        blob.add('{')
+        hot = HOT_IDENTS[(f + k + rev) % len(HOT_IDENTS)]
+        line = blob.add(f'\t{hot}(x);')
+        blob.refs.append((hot, line))
+        for _ in range(2):
+            callee = idents[rng.randrange(len(idents))]
+            line = blob.add(f'\tx += {callee}(x - {rev});')
+            blob.refs.append((callee, line))
+        blob.add('\treturn x;')
+        blob.add('}')
+    return blob
+
+def git_sha(content):
+    return hashlib.sha1(b'blob %d\0' % len(content) + content).hexdigest()
+
+def generate(base_dir, files=1000, tags=10, changes=0.05, idents=None, seed=0, log=print):
+    '''Creates a synthetic project in base_dir, see the module comment.'''
+    rng = random.Random(seed)
+    idents = [f'sym{i}' for i in range(idents or max(files, 10))]
+    repo_dir = os.path.join(base_dir, PROJECT, 'repo')
+    data_dir = os.path.join(base_dir, PROJECT, 'data')
+    os.makedirs(repo_dir)
+    os.makedirs(data_dir)
+    start = time.perf_counter()
+
+    subprocess.run(['git', 'init', '-q', repo_dir], check=True)
+    importer = subprocess.Popen(['git', '-C', repo_dir, 'fast-import', '--quiet'], stdin=subprocess.PIPE)
+    out = importer.stdin
+
+    # Blob ids are sequential, in the order blobs are first seen,
+    # as update.py does
+    blob_ids = {}
+    blobs = []
+    def add_blob(blob, path):
+        content = blob.content()
+        # Only the symbols are needed from now on
+        blob.lines = None
+        sha = git_sha(content)
+        blob_id = blob_ids.get(sha)
+        if blob_id is None:
+            blob_id = blob_ids[sha] = len(blobs)
+            blobs.append((sha, blob, os.path.basename(path)))
+            out.write(b'blob\nmark :%d\ndata %d\n' % (blob_id + 1, len(content)) + content + b'\n')
+        return blob_id
+
+    tree = {'include/hot.h': add_blob(make_header(), 'include/hot.h')}
+    revs = {}
+    for f in range(files):
+        tree[file_path(f)] = add_blob(make_file(f, 0, idents, rng), file_path(f))
+        revs[f] = 0
+
+    versions = []
+    # Commit marks are above all blob marks
+    commit_mark = 10**9
+    parent = None
+    next_file = files
+    for t in range(tags):
+        changed = {}
+        if t > 0:
+            for f in rng.sample(sorted(revs), max(1, int(len(revs) * changes))):
+                revs[f] = t
+                changed[file_path(f)] = add_blob(make_file(f, t, idents, rng), file_path(f))
+            revs[next_file] = t
+            changed[file_path(next_file)] = add_blob(make_file(next_file, t, idents, rng), file_path(next_file))
+            next_file += 1
+        else:
+            changed = dict(tree)
+        tree.update(changed)
+
+        commit_mark += 1
+        message = f'Release {tag_name(t)}\n'.encode()
+        when = 1500000000 + t * 86400
+        out.write(b'commit refs/heads/master\nmark :%d\n' % commit_mark)
+        out.write(b'author Synth <synth@example.com> %d +0000\n' % when)
+        out.write(b'committer Synth <synth@example.com> %d +0000\n' % when)
+        out.write(b'data %d\n' % len(message) + message)
+        if parent is not None:
+            out.write(b'from :%d\n' % parent)
+        for path, blob_id in sorted(changed.items()):
+            out.write(b'M 100644 :%d %s\n' % (blob_id + 1, path.encode()))
+        out.write(b'\n')
+        out.write(b'reset refs/tags/%s\nfrom :%d\n\n' % (tag_name(t).encode(), commit_mark))
+        parent = commit_mark
+        versions.append((tag_name(t), dict(tree)))
+
+    out.close()
+    if importer.wait() != 0:
+        raise RuntimeError('git fast-import failed')
+    log(f'repository: {len(blobs)} blobs, {tags} tags ({time.perf_counter() - start:.1f}s)')
+
+    # Lists are built as raw lines: appending to DefList/RefList/PathList
+    # copies their whole content each time
+    db = data.DB(data_dir, readonly=False)
+    defs = {}
+    refs = {}
+    docs = {}
+    for blob_id, (sha, blob, filename) in enumerate(blobs):
+        db.blob.put(sha, blob_id)
+        db.hash.put(blob_id, sha)
+        db.file.put(blob_id, filename)
+        for ident, type, line in blob.defs:
+            defs.setdefault(ident, []).append(f'{blob_id}{data.defTypeD[type]}{line}C')
+        blob_refs = {}
+        for ident, line in blob.refs:
+            blob_refs.setdefault(ident, []).append(str(line))
+        for ident, lines in blob_refs.items():
+            refs.setdefault(ident, []).append(f'{blob_id}:{",".join(lines)}:C\n')
+        for ident, line in blob.docs:
+            docs.setdefault(ident, []).append(f'{blob_id}:{line}:C\n')
+
+    for tag, version_tree in versions:
+        lines = [b'%d %s\n' % (blob_id, path.encode())
+                 for path, blob_id in sorted(version_tree.items(), key=lambda item: (item[1], item[0]))]
+        db.vers.put(tag, data.PathList(b''.join(lines)))
+    for ident, entries in defs.items():
+        db.defs.put(ident, data.DefList((','.join(entries) + '#C').encode()))
+        db.defs_cache['C'].put(ident, b'')
+    for ident, entries in refs.items():
+        db.refs.put(ident, data.RefList(''.join(entries).encode()))
+    for ident, entries in docs.items():
+        db.docs.put(ident, data.RefList(''.join(entries).encode()))
+    db.vars.put('numBlobs', len(blobs))
+    db.close()
+    log(f'index: {len(defs)} identifiers ({time.perf_counter() - start:.1f}s)')
+    return repo_dir, data_dir
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('base_dir', help="Directory to create, used as LXR_BASE_DIR")
+    parser.add_argument('--files', type=int, default=1000, help="Number of files in the first tag")
+    parser.add_argument('--tags', type=int, default=10, help="Number of tags")
+    parser.add_argument('--changes', type=float, default=0.05, help="Fraction of the files modified by each tag")
+    parser.add_argument('--idents', type=int, default=None, help="Number of function identifiers, default: number of files")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.base_dir, args.files, args.tags, args.changes, args.idents, args.seed)
@@ -0,0 +1,140 @@
+#  In-process catalog of the tags of a repository.
+#
+#  Tags are read from packed-refs and refs/tags instead of running
+#  `git tag | sort -V` for each request. The catalog is sorted once in
+#  version order, with the topmenu/submenu hierarchy of `script.sh
+#  list-tags -h` precomputed, and only rebuilt when packed-refs or the
+#  refs/tags directories change.
+
+import os
+import re
+import subprocess
+import threading
+
+import metrics
+
+# Same hierarchy as list_tags_h() in script.sh
+menu_regex = re.compile(r'^(v[0-9]*)\.([0-9]*)(.*)$')
+
+def char_order(c):
+    if c == '~':
+        return -1
+    if c.isalpha():
+        return ord(c)
+    return ord(c) + 256
+
+def version_key(version):
+    '''Sort key equivalent to `sort -V` for tag names: alternating non-digit
+        parts, compared with letters before other characters, and numbers.'''
+    key = []
+    for text, number in re.findall(r'(\D*)(\d*)', version):
+        if not text and not number:
+            continue
+        key.append(tuple(char_order(c) for c in text) + (0,))
+        key.append(int(number or 0))
+    return key
+
+def tag_sort_key(tag):
+    # script.sh appends .0 before sorting so that v4.10 comes after v4.10-rc1
+    return version_key(tag + '.0')
+
+class Tags:
+    '''Snapshot of the tags of a repository.
+        names  : tag names, oldest first
+        shas   : tag name -> object SHA
+        menu   : (topmenu, submenu, tag) tuples, newest first, as `script.sh list-tags -h`
+        latest : tags which are not release candidates, newest first'''
+    def __init__(self, refs, dirs, stamp):
+        self.stamp = stamp
+        self.dirs = dirs
+        self.shas = refs
+        self.names = sorted(refs, key=tag_sort_key)
+        self.menu = []
+        for tag in reversed(self.names):
+            m = menu_regex.match(tag)
+            if m:
+                self.menu.append((m.group(1), m.group(1) + '.' + m.group(2), tag))
+            else:
+                self.menu.append(('FIXME', 'FIXME', tag))
+        self.latest = sorted((tag for tag in refs if '-rc' not in tag), key=version_key, reverse=True)
+
+class TagCatalog:
+    def __init__(self, repo_dir):
+        self.repo_dir = repo_dir
+        args = ['git', '-C', repo_dir, 'rev-parse', '--git-common-dir']
+        metrics.count_subprocess(args)
+        res = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        git_dir = res.stdout.decode().strip() or '.git'
+        self.git_dir = os.path.join(repo_dir, git_dir)
+        self.lock = threading.Lock()
+        self.tags = None
+
+    # Changes each time a tag is added, removed or packed: a new loose tag
+    # changes the mtime of its directory, a new directory the mtime of its parent
+    def stamp(self, dirs):
+        stamp = []
+        for path in [os.path.join(self.git_dir, 'packed-refs')] + dirs:
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    # Directories of loose tags
+    def tag_dirs(self):
+        tags_dir = os.path.join(self.git_dir, 'refs', 'tags')
+        return [root for root, _, _ in os.walk(tags_dir)] or [tags_dir]
+
+    # Returns the tag name -> SHA dict
+    def read_refs(self):
+        refs = {}
+        try:
+            with open(os.path.join(self.git_dir, 'packed-refs'), 'rb') as f:
+                for line in f:
+                    if line.startswith((b'#', b'^')):
+                        continue
+                    sha, _, name = line.rstrip(b'\n').partition(b' ')
+                    if name.startswith(b'refs/tags/'):
+                        refs[name[10:].decode()] = sha.decode()
+        except FileNotFoundError:
+            pass
+
+        # Loose refs take precedence over packed ones
+        tags_dir = os.path.join(self.git_dir, 'refs', 'tags')
+        for root, _, files in os.walk(tags_dir):
+            for filename in files:
+                path = os.path.join(root, filename)
+                try:
+                    with open(path) as f:
+                        sha = f.read().strip()
+                except OSError:
+                    continue
+                refs[os.path.relpath(path, tags_dir).replace(os.sep, '/')] = sha
+        return refs
+
+    def get(self):
+        '''Returns the current Tags snapshot, rebuilt if the tags have changed.'''
+        tags = self.tags
+        if tags is not None and tags.stamp == self.stamp(tags.dirs):
+            return tags
+        with self.lock:
+            tags = self.tags
+            if tags is None or tags.stamp != self.stamp(tags.dirs):
+                # Take the stamp first: a tag added while reading triggers a new rebuild
+                dirs = self.tag_dirs()
+                stamp = self.stamp(dirs)
+                tags = self.tags = Tags(self.read_refs(), dirs, stamp)
+            return tags
+
+catalogs = {}
+catalogs_lock = threading.Lock()
+
+def get_catalog(repo_dir):
+    '''Returns the TagCatalog shared by the whole process for a repository.'''
+    repo_dir = os.path.abspath(repo_dir)
+    with catalogs_lock:
+        catalog = catalogs.get(repo_dir)
+        if catalog is None:
+            catalog = catalogs[repo_dir] = TagCatalog(repo_dir)
+        return catalog
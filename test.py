@@ -25,26 +25,21 @@ from query import get_query
 
 
 REPO_DIR="/home/ziyang/works/kernel/linux"
-import git 
-repo = git.Repo(REPO_DIR)
+from gitstore import GitStore
+store = GitStore(REPO_DIR)
 import os
 
-# 检出特定版本
-# repo.git.checkout("v4.10")
+# 读取特定版本的commit信息,不需要检出
 # try:
-#     cres = repo.git.checkout("v4.22")
-#     print(f"cres = {cres}")
-
-#     # 获取当前commit的log信息
-#     commit = repo.head.commit
-#     print(f"Commit Hash: {commit.hexsha}")
-#     print(f"Author: {commit.author.name} <{commit.author.email}>")
-#     print(f"Date: {commit.authored_datetime}")
-#     print(f"Message:\n{commit.message}")
+#     info = store.commit_info("v4.10")
+#     print(f"Commit Hash: {info['sha']}")
+#     print(f"Author: {info['author']} <{info['author_email']}>")
+#     print(f"Date: {info['date']}")
+#     print(f"Message:\n{info['message']}")
 
 #     # 获取该commit的父commit信息
-#     for parent in commit.parents:
-#         print(f"\nParent Commit: {parent.hexsha}")
+#     for parent in info["parents"]:
+#         print(f"\nParent Commit: {parent}")
 
 # except Exception as e:
 #     print(e)
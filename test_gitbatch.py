@@ -0,0 +1,47 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+import gitbatch
+
+
+class CatFilePoolTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.repo_dir = self.tmp.name
+        env = dict(os.environ, GIT_AUTHOR_NAME="test", GIT_AUTHOR_EMAIL="test@example.com",
+                   GIT_COMMITTER_NAME="test", GIT_COMMITTER_EMAIL="test@example.com")
+        with open(os.path.join(self.repo_dir, "a b.txt"), "w") as f:
+            f.write("a\n")
+        for args in (["init", "-q"], ["add", "."], ["commit", "-q", "-m", "first"], ["tag", "v1"]):
+            subprocess.run(["git", "-C", self.repo_dir, *args], env=env, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.pool = gitbatch.CatFilePool(self.repo_dir, size=1)
+
+    def tearDown(self):
+        self.pool.close()
+        self.tmp.cleanup()
+
+    def test_missing_ref_with_space(self):
+        self.assertEqual(self.pool.info_many(["v1 foo^{commit}", "v1:a b.txt", "v1:a c.txt"])[0::2], [None, None])
+        self.assertEqual(self.pool.read("v1:a b.txt")[2], b"a\n")
+
+    def test_slot_released_when_git_cannot_start(self):
+        start = gitbatch.CatFileProcess.start
+
+        def fail(proc):
+            raise OSError("cannot start git")
+
+        gitbatch.CatFileProcess.start = fail
+        try:
+            with self.assertRaises(OSError):
+                self.pool.info("v1")
+        finally:
+            gitbatch.CatFileProcess.start = start
+        # The only slot of the pool is still available
+        self.assertEqual(self.pool.info("v1")[1], "commit")
+
+
+if __name__ == "__main__":
+    unittest.main()
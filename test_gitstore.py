@@ -0,0 +1,63 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+import gitstore
+from gitstore import GitStore
+
+
+def git(repo_dir, *args):
+    env = dict(os.environ, GIT_AUTHOR_NAME="test", GIT_AUTHOR_EMAIL="test@example.com",
+               GIT_COMMITTER_NAME="test", GIT_COMMITTER_EMAIL="test@example.com")
+    subprocess.run(["git", "-C", repo_dir, *args], env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class ReadPatchesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.repo_dir = self.tmp.name
+        git(self.repo_dir, "init", "-q")
+        for name, text in (("f1.txt", "a\n"), ("f2.txt", "g\n"), ("f3.txt", "x\n")):
+            with open(os.path.join(self.repo_dir, name), "w") as f:
+                f.write(text)
+        git(self.repo_dir, "add", ".")
+        git(self.repo_dir, "commit", "-q", "-m", "first")
+
+        # f2.txt变为符号链接(类型变化),f3.txt被修改
+        os.unlink(os.path.join(self.repo_dir, "f2.txt"))
+        os.symlink("g1.txt", os.path.join(self.repo_dir, "f2.txt"))
+        with open(os.path.join(self.repo_dir, "f3.txt"), "w") as f:
+            f.write("y\n")
+        git(self.repo_dir, "add", "-A")
+        git(self.repo_dir, "commit", "-q", "-m", "second")
+        self.store = GitStore(self.repo_dir)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def check_typechange(self):
+        info = self.store.commit_info("HEAD")
+        changes = info["changes"]
+        self.assertEqual([(c.path, c.change_type) for c in changes], [("f2.txt", "T"), ("f3.txt", "M")])
+        patches = dict(zip((c.path for c in changes), self.store.read_patches(info, changes, 10000)))
+        self.assertEqual(patches["f2.txt"][0],
+                         "@@ -1 +0,0 @@\n-g\n@@ -0,0 +1 @@\n+g1.txt\n\\ No newline at end of file\n")
+        self.assertEqual(patches["f3.txt"][0], "@@ -1 +1 @@\n-x\n+y\n")
+
+    def test_typechange(self):
+        self.check_typechange()
+
+    def test_typechange_without_pathspecs(self):
+        # 文件太多时不传路径,从完整输出中跳过不需要的文件
+        max_pathspecs = gitstore.MAX_PATHSPECS
+        gitstore.MAX_PATHSPECS = 0
+        try:
+            self.check_typechange()
+        finally:
+            gitstore.MAX_PATHSPECS = max_pathspecs
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+#  In-process equivalent of `script.sh tokenize-file`.
+#
+#  script.sh replaces newlines with \1, runs a perl substitution which puts
+#  every identifier on its own line, and drops the last line with head.
+#  The result is a list of tokens alternating between "everything else"
+#  (even positions) and identifiers (odd positions).
+
+import re
+
+# Same regexes as tokenize_file() in script.sh
+regex = re.compile(rb'((/\*.*?\*/|//.*?\001|[^\']"(\\.|.)*?"|# *include *<.*?>|\W)+)(\w+)?')
+
+# Don't cut around '-' in devicetrees
+regex_dts = re.compile(rb'((/\*.*?\*/|//.*?\001|[^\']"(\\.|.)*?"|# *include *<.*?>|[^\w-])+)([\w-]+)?')
+
+def tokenize(content, family):
+    '''Yields the tokens of a file, as `script.sh tokenize-file` would print them.'''
+    content = content.replace(b'\n', b'\1')
+    pattern = regex_dts if family == 'D' else regex
+
+    # Text which does not match the regex is left in place by perl, and ends
+    # up at the start of the next line
+    pending = None
+    last = 0
+    for m in pattern.finditer(content):
+        if pending is not None:
+            yield pending
+        yield content[last:m.start()] + m.group(1)
+        pending = m.group(4) or b''
+        last = m.end()
+
+    # `head -n -1` drops the last line: the trailing unmatched text if
+    # there is some, otherwise the last identifier
+    if last < len(content) and pending is not None:
+        yield pending
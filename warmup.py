@@ -0,0 +1,88 @@
+#  Opt-in background warm-up of the caches, enabled with LXR_WARMUP=1.
+#
+#  Once the server has started, a low priority thread loads, for each
+#  version of LXR_WARMUP_VERSIONS ("latest" is the newest indexed release),
+#  the file manifest and the path index, then fills the identifier cache
+#  with the complete results of LXR_WARMUP_IDENTS, from which query_ident
+#  cuts its pages. Before each step the thread waits until no tool call is
+#  running, so a request is delayed by at most one step.
+
+import logging
+import os
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('LXR_WARMUP', '0') not in ('', '0')
+VERSIONS = [v.strip() for v in os.environ.get('LXR_WARMUP_VERSIONS', 'latest').split(',') if v.strip()]
+IDENTS = [i.strip() for i in os.environ.get('LXR_WARMUP_IDENTS', '').split(',') if i.strip()]
+
+# Seconds to wait after startup, to leave the initialize handshake alone
+DELAY = float(os.environ.get('LXR_WARMUP_DELAY', '1'))
+
+# Seconds between two checks for running tool calls
+IDLE_POLL = 0.05
+
+state = {
+    'status': 'disabled',
+    'done': 0,
+    'failed': 0,
+    'elapsed': None,
+}
+
+def lower_priority():
+    # Linux applies nice values per thread, git processes started by the
+    # thread inherit it
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError):
+        pass
+
+def steps(q, store, versions, idents):
+    '''Yields the (description, function) warm-up steps.'''
+    yield 'tags', store.get_tags
+    for version in versions:
+        if version == 'latest':
+            version = q.query('latest')
+        yield f'manifest {version}', lambda version=version: q.get_manifest(version)
+        yield f'path index {version}', lambda version=version: store.get_index(version)
+        for ident in idents:
+            yield f'ident {ident} {version}', lambda version=version, ident=ident: q.get_idents(version, ident, 'C')
+
+def run(get_query, get_store, busy, versions=VERSIONS, idents=IDENTS, delay=DELAY):
+    lower_priority()
+    time.sleep(delay)
+    start = time.perf_counter()
+    state['status'] = 'running'
+    try:
+        for description, fn in steps(get_query(), get_store(), versions, idents):
+            while busy():
+                time.sleep(IDLE_POLL)
+            try:
+                fn()
+                state['done'] += 1
+            except Exception as e:
+                logger.warning('warm-up of %s failed: %s', description, e)
+                state['failed'] += 1
+        state['status'] = 'done'
+    except Exception as e:
+        logger.warning('warm-up failed: %s', e)
+        state['status'] = 'failed'
+    state['elapsed'] = time.perf_counter() - start
+    logger.info('warm-up %s in %.1fs', state['status'], state['elapsed'])
+
+def start(get_query, get_store, busy):
+    '''Starts the warm-up thread if LXR_WARMUP is set.
+        get_query and get_store return the Query and GitStore to warm up,
+        busy returns True while tool calls are running.'''
+    if not ENABLED:
+        return None
+    state['status'] = 'waiting'
+    thread = threading.Thread(target=run, args=(get_query, get_store, busy), name='lxr-warmup', daemon=True)
+    thread.start()
+    return thread
+
+metrics.sections['warmup'] = lambda: dict(state)